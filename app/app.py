@@ -1,8 +1,16 @@
 import os
 from flask import Flask
 from config import Config
-from database import init_db_command, close_db
+from database import init_db_command, close_db, init_db_app
 from routes import register_routes
+from services.deployment_service import DeploymentService
+from services.event_service import EventService
+from services.metrics_service import MetricsRegistry
+from services.import_service import import_hosts_command
+from services.playbook_service import PlaybookCatalog
+from services.profiling_service import ProfilingService
+from services.scheduler_service import DeploymentScheduler
+from services.stats_service import StatsService
 
 def create_app():
     """Factory pour créer l'application Flask"""
@@ -11,6 +19,7 @@ def create_app():
     
     # Initialize database
     app.cli.add_command(init_db_command)
+    app.cli.add_command(import_hosts_command)
     app.teardown_appcontext(close_db)
     
     # Register routes
@@ -21,8 +30,31 @@ def create_app():
     os.makedirs(Config.LOG_DIR, exist_ok=True)
     os.makedirs(Config.PLAYBOOKS_DIR, exist_ok=True)
     
+    # Apply pending schema migrations
+    init_db_app(app)
+    
+    # Request metrics served by /metrics
+    MetricsRegistry.init_app(app)
+    
+    # Opt-in request profiling and slow request capture
+    ProfilingService.init_app(app)
+    
+    # Roll up and prune the stats time series in the background
+    StatsService.start_compaction(app)
+    
+    # Live events for changes made by other worker processes
+    EventService.start_watcher(app)
+    
+    # Playbook catalog kept in memory
+    PlaybookCatalog.start_watcher(app)
+    
+    # Deployment job workers
+    DeploymentScheduler.init_app(app, DeploymentService.run_job)
+    
     return app
 
 if __name__ == '__main__':
+    # Lets background workers tell the reloader's watcher process from the server
+    os.environ.setdefault('FLASK_DEBUG', '1')
     app = create_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -9,13 +9,110 @@ class Config:
     INVENTORY_DIR = "/opt/linsec/taskengine/inventories"
     ANSIBLE_DIR = "/opt/linsec/taskengine"
     PLAYBOOKS_DIR = os.path.join(ANSIBLE_DIR, "playbooks")
+    CALLBACK_PLUGINS_DIR = os.path.join(ANSIBLE_DIR, "callback_plugins")
+    FACT_CACHE_DIR = os.environ.get('LINSEC_FACT_CACHE_DIR', "/opt/linsec/.ansible/fact_cache")
+    FACT_CACHE_TTL = int(os.environ.get('LINSEC_FACT_CACHE_TTL', str(24 * 3600)))
+    PLAYBOOK_CATALOG_POLL_INTERVAL = 2
+    # Run ansible-playbook --syntax-check on top of the YAML and structure checks
+    PLAYBOOK_SYNTAX_CHECK = os.environ.get('LINSEC_PLAYBOOK_SYNTAX_CHECK', '1') == '1'
+    PLAYBOOK_SYNTAX_CHECK_TIMEOUT = int(os.environ.get('LINSEC_PLAYBOOK_SYNTAX_CHECK_TIMEOUT', '60'))
+    # Replaces callback_whitelist of ansible.cfg, keep its callbacks
+    ANSIBLE_CALLBACKS_ENABLED = "timer,profile_tasks,linsec_results"
     LOG_DIR = "/opt/linsec/logs"
+
+    # SQLite
+    SQLITE_POOL_SIZE = int(os.environ.get('LINSEC_SQLITE_POOL_SIZE', '16'))
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('LINSEC_SQLITE_BUSY_TIMEOUT', '5'))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('LINSEC_SQLITE_CACHE_SIZE_KB', '16384'))
+    SQLITE_MMAP_SIZE = int(os.environ.get('LINSEC_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+    # Stats time series (retentions in seconds). Raw samples must be kept
+    # at least one day, the day bucket they complete until it is rolled up;
+    # the application refuses to start with a shorter raw retention.
+    STATS_RAW_RETENTION = int(os.environ.get('LINSEC_STATS_RAW_RETENTION', str(2 * 86400)))
+    STATS_MINUTE_RETENTION = int(os.environ.get('LINSEC_STATS_MINUTE_RETENTION', str(7 * 86400)))
+    STATS_HOUR_RETENTION = int(os.environ.get('LINSEC_STATS_HOUR_RETENTION', str(90 * 86400)))
+    STATS_DAY_RETENTION = int(os.environ.get('LINSEC_STATS_DAY_RETENTION', str(5 * 365 * 86400)))
+    STATS_COMPACTION_INTERVAL = int(os.environ.get('LINSEC_STATS_COMPACTION_INTERVAL', '60'))
+    STATS_HISTORY_MAX_POINTS = 1000
+
+    # Host listing
+    HOSTS_PAGE_SIZE = 500
+    HOSTS_MAX_PAGE_SIZE = 5000
+
+    # Conditional GET
+    RESPONSE_CACHE_SIZE = 256
+
+    # Server-sent events
+    SSE_KEEPALIVE_INTERVAL = 15
+    SSE_RETRY_MS = 5000
+    SSE_EVENT_BUFFER_SIZE = int(os.environ.get('LINSEC_SSE_EVENT_BUFFER_SIZE', '1024'))
+    # Host changes above this size are sent as a full snapshot instead of a delta
+    SSE_DELTA_MAX_HOSTS = 1000
+    # How often changes made by other processes are picked up, a memory read when nothing changed
+    SSE_REMOTE_POLL_INTERVAL = 1
+
+    # Deployment scheduler
+    DEPLOYMENT_WORKERS = int(os.environ.get('LINSEC_DEPLOYMENT_WORKERS', str(os.cpu_count() or 1)))
+    # ansible-playbook processes of all running deployments, shards included
+    DEPLOYMENT_MAX_CONCURRENT = int(os.environ.get('LINSEC_DEPLOYMENT_MAX_CONCURRENT', str(os.cpu_count() or 1)))
+    DEPLOYMENT_MAX_PER_ENVIRONMENT = int(os.environ.get('LINSEC_DEPLOYMENT_MAX_PER_ENVIRONMENT', '2'))
+    DEPLOYMENT_QUEUE_MAX = int(os.environ.get('LINSEC_DEPLOYMENT_QUEUE_MAX', '100'))
+    DEPLOYMENT_POLL_INTERVAL = 2
+    DEPLOYMENT_HEARTBEAT_INTERVAL = 10
+    # Running jobs without a heartbeat for this long belong to a dead process
+    DEPLOYMENT_STALE_AFTER = 60
+    # Deployments above this many hosts run as several ansible-playbook processes,
+    # as many as DEPLOYMENT_MAX_CONCURRENT leaves free when they start
+    DEPLOYMENT_SHARD_MIN_HOSTS = int(os.environ.get('LINSEC_DEPLOYMENT_SHARD_MIN_HOSTS', '200'))
+    DEPLOYMENT_MAX_SHARDS = int(os.environ.get('LINSEC_DEPLOYMENT_MAX_SHARDS', str(os.cpu_count() or 1)))
+    DEPLOYMENT_MAX_ATTEMPTS = int(os.environ.get('LINSEC_DEPLOYMENT_MAX_ATTEMPTS', '2'))
+    DEPLOYMENTS_PAGE_SIZE = 50
+    DEPLOYMENTS_MAX_PAGE_SIZE = 500
+
+    # Live deployment logs
+    LOG_TAIL_BUFFER_SIZE = 1024 * 1024
+    LOG_TAIL_CHUNK_SIZE = 64 * 1024
+    LOG_TAIL_POLL_INTERVAL = 0.5
+
+    # Prometheus metrics, written by each worker process for /metrics
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('LINSEC_METRICS_FLUSH_INTERVAL', '5'))
+
+    # Request profiling: per request with the X-Linsec-Profile header set to
+    # the token, or on a percentage of requests. Requests slower than the
+    # threshold are kept, with their profile if they were profiled.
+    PROFILING_TOKEN = os.environ.get('LINSEC_PROFILING_TOKEN', '')
+    PROFILING_SAMPLE_RATE = float(os.environ.get('LINSEC_PROFILING_SAMPLE_RATE', '0'))
+    PROFILING_MAX_STATEMENTS = 1000
+    PROFILING_TOP_FUNCTIONS = 50
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('LINSEC_SLOW_REQUEST_THRESHOLD', '1.0'))
+    SLOW_REQUEST_STORE_SIZE = int(os.environ.get('LINSEC_SLOW_REQUEST_STORE_SIZE', '100'))
+
+    # Dynamic inventory reading the hosts table, see taskengine/linsec_inventory.py
+    INVENTORY_SCRIPT = os.path.join(ANSIBLE_DIR, "linsec_inventory.py")
+    INVENTORY_CACHE_DIR = os.environ.get('LINSEC_INVENTORY_CACHE_DIR', "/opt/linsec/.ansible/inventory_cache")
+    INVENTORY_CACHE_TTL = int(os.environ.get('LINSEC_INVENTORY_CACHE_TTL', '5'))
     
     @staticmethod
     def get_database_path():
         """Retourne le chemin de la base de données"""
         return os.path.join(current_app.instance_path, 'linsec.db')
     
+    @staticmethod
+    def get_data_version_path():
+        """Retourne le chemin des compteurs de version des données"""
+        return os.path.join(current_app.instance_path, 'data_version')
+    
+    @staticmethod
+    def get_metrics_path():
+        """Retourne le dossier des métriques de chaque processus"""
+        return os.path.join(current_app.instance_path, 'metrics')
+    
+    @staticmethod
+    def get_slow_requests_path():
+        """Retourne le dossier des requêtes lentes enregistrées"""
+        return os.path.join(current_app.instance_path, 'slow_requests')
+    
     @staticmethod
     def get_inventory_path(environment):
         """Retourne le chemin de l'inventaire pour un environnement"""
@@ -1,32 +1,397 @@
 import os
+import json
+import queue
 import sqlite3
+import threading
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 from config import Config
+from services.data_version import DataVersion
+from services.event_bus import EventBus
+from services.metrics_service import DB_DURATION, timed_methods
+
+
+class ConnectionPool:
+    """Thread-safe pool of tuned SQLite connections"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, timeout=Config.SQLITE_BUSY_TIMEOUT, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT * 1000)}')
+        conn.execute(f'PRAGMA cache_size = -{Config.SQLITE_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {Config.SQLITE_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=Config.SQLITE_BUSY_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError("Aucune connexion à la base de données disponible")
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """Connection pool of the current application database"""
+    path = Config.get_database_path()
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path, Config.SQLITE_POOL_SIZE)
+                _pools[path] = pool
+    return pool
+
 
 def get_db():
     """Obtenir la connexion à la base de données"""
     if 'db' not in g:
-        g.db = sqlite3.connect(Config.get_database_path())
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
+        # Set by the request profiler to capture the SQL it issues
+        trace = g.get('sql_trace')
+        if trace is not None:
+            g.db.set_trace_callback(trace)
     return g.db
 
 def close_db(error):
-    """Fermer la connexion à la base de données"""
-    if hasattr(g, 'db'):
-        g.db.close()
+    """Rendre la connexion au pool"""
+    release_db()
+
+def release_db():
+    """Return the connection of the current context to the pool early"""
+    db = g.pop('db', None)
+    if db is not None:
+        if g.get('sql_trace') is not None:
+            db.set_trace_callback(None)
+        get_pool().release(db)
+
+
+def split_groups(groups):
+    """Split the comma-joined groups column"""
+    return [group for group in (groups or '').split(',') if group]
+
+
+def _migration_indexes(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_hosts_name ON hosts(name)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_hosts_environment ON hosts(environment, name)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_hosts_added_date ON hosts(added_date, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_stats_timestamp ON stats(timestamp)')
+
+
+def _migration_host_groups(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS host_groups ('
+        ' host_id INTEGER NOT NULL,'
+        ' environment TEXT NOT NULL,'
+        ' group_name TEXT NOT NULL,'
+        ' PRIMARY KEY (environment, group_name, host_id)'
+        ') WITHOUT ROWID'
+    )
+    db.execute('CREATE INDEX IF NOT EXISTS idx_host_groups_host ON host_groups(host_id)')
+    rows = db.execute("SELECT id, environment, groups FROM hosts WHERE groups <> ''").fetchall()
+    db.executemany(
+        'INSERT OR IGNORE INTO host_groups (host_id, environment, group_name) VALUES (?, ?, ?)',
+        ((row[0], row[1], group) for row in rows for group in split_groups(row[2]))
+    )
+
+
+def _counter_upsert(scope, key, host_delta, secured_delta):
+    return (
+        f"INSERT INTO host_counters (scope, key, host_count, secured_count) "
+        f"VALUES ('{scope}', {key}, {host_delta}, {secured_delta}) "
+        f"ON CONFLICT (scope, key) DO UPDATE SET "
+        f"host_count = host_count + excluded.host_count, "
+        f"secured_count = secured_count + excluded.secured_count;"
+    )
+
+
+def _migration_host_counters(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS host_counters ('
+        ' scope TEXT NOT NULL,'
+        ' key TEXT NOT NULL,'
+        ' host_count INTEGER NOT NULL DEFAULT 0,'
+        ' secured_count INTEGER NOT NULL DEFAULT 0,'
+        ' PRIMARY KEY (scope, key)'
+        ') WITHOUT ROWID'
+    )
+
+    # Counters are maintained by triggers in the same transaction as the host change
+    scopes = [('total', "''"), ('environment', '{row}.environment'), ('security_level', '{row}.security_level')]
+    insert = ''.join(
+        _counter_upsert(scope, key.format(row='NEW'), 1, "NEW.status = 'secured'") for scope, key in scopes
+    )
+    delete = ''.join(
+        _counter_upsert(scope, key.format(row='OLD'), -1, "-(OLD.status = 'secured')") for scope, key in scopes
+    )
+    db.execute(f'CREATE TRIGGER IF NOT EXISTS trg_hosts_counters_insert AFTER INSERT ON hosts BEGIN {insert} END')
+    db.execute(f'CREATE TRIGGER IF NOT EXISTS trg_hosts_counters_delete AFTER DELETE ON hosts BEGIN {delete} END')
+    db.execute(
+        'CREATE TRIGGER IF NOT EXISTS trg_hosts_counters_update '
+        'AFTER UPDATE OF status, environment, security_level ON hosts '
+        'WHEN OLD.status IS NOT NEW.status OR OLD.environment IS NOT NEW.environment '
+        'OR OLD.security_level IS NOT NEW.security_level '
+        f'BEGIN {delete}{insert}'
+        "UPDATE host_counters SET secured_count = secured_count "
+        "+ (NEW.status = 'secured') - (OLD.status = 'secured') "
+        "WHERE scope = 'group' AND key IN (SELECT group_name FROM host_groups WHERE host_id = NEW.id); "
+        'END'
+    )
+
+    secured = "(SELECT status = 'secured' FROM hosts WHERE id = {row}.host_id)"
+    db.execute(
+        'CREATE TRIGGER IF NOT EXISTS trg_host_groups_counters_insert AFTER INSERT ON host_groups BEGIN '
+        + _counter_upsert('group', 'NEW.group_name', 1, secured.format(row='NEW')) + ' END'
+    )
+    db.execute(
+        'CREATE TRIGGER IF NOT EXISTS trg_host_groups_counters_delete AFTER DELETE ON host_groups BEGIN '
+        + _counter_upsert('group', 'OLD.group_name', -1, '-' + secured.format(row='OLD')) + ' END'
+    )
+
+    db.execute('DELETE FROM host_counters')
+    db.execute(
+        "INSERT INTO host_counters (scope, key, host_count, secured_count) "
+        "SELECT 'total', '', COUNT(*), COALESCE(SUM(status = 'secured'), 0) FROM hosts"
+    )
+    for scope in ('environment', 'security_level'):
+        db.execute(
+            f"INSERT INTO host_counters (scope, key, host_count, secured_count) "
+            f"SELECT '{scope}', {scope}, COUNT(*), SUM(status = 'secured') FROM hosts GROUP BY {scope}"
+        )
+    db.execute(
+        "INSERT INTO host_counters (scope, key, host_count, secured_count) "
+        "SELECT 'group', hg.group_name, COUNT(*), SUM(h.status = 'secured') "
+        "FROM host_groups hg JOIN hosts h ON h.id = hg.host_id GROUP BY hg.group_name"
+    )
+
+
+HOST_FIELDS = ('id', 'name', 'ip', 'environment', 'security_level', 'groups', 'status', 'added_date')
+
+STATS_METRICS = ('host_count', 'secured_count', 'vulnerabilities_count')
+
+
+def _migration_stats_rollups(db):
+    columns = ''.join(
+        f' {metric}_sum INTEGER NOT NULL, {metric}_min INTEGER NOT NULL, {metric}_max INTEGER NOT NULL,'
+        for metric in STATS_METRICS
+    )
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS stats_rollups ('
+        ' resolution TEXT NOT NULL,'
+        ' bucket INTEGER NOT NULL,'
+        ' samples INTEGER NOT NULL,'
+        f'{columns}'
+        ' PRIMARY KEY (resolution, bucket)'
+        ') WITHOUT ROWID'
+    )
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS stats_rollup_state ('
+        ' resolution TEXT PRIMARY KEY,'
+        ' watermark INTEGER NOT NULL'
+        ')'
+    )
+
+
+def _migration_host_listing(db):
+    # Keysets of filtered listings are read in index order, without a sort
+    db.execute('CREATE INDEX IF NOT EXISTS idx_hosts_environment_added ON hosts(environment, added_date, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_hosts_status_added ON hosts(status, added_date, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_host_groups_group ON host_groups(group_name, host_id)')
+
+
+def _migration_deployments(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS deployments ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' environment TEXT NOT NULL,'
+        ' playbook TEXT NOT NULL,'
+        ' hosts TEXT NOT NULL,'
+        ' priority INTEGER NOT NULL DEFAULT 0,'
+        " status TEXT NOT NULL DEFAULT 'queued',"
+        ' worker TEXT,'
+        ' created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,'
+        ' started_at TIMESTAMP,'
+        ' finished_at TIMESTAMP'
+        ')'
+    )
+    db.execute('CREATE INDEX IF NOT EXISTS idx_deployments_queue ON deployments(status, priority DESC, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_deployments_environment ON deployments(environment, status)')
+
+
+def _migration_deployment_history(db):
+    for column in ('exit_code INTEGER', 'log_path TEXT', 'duration REAL',
+                   'heartbeat TIMESTAMP', 'attempts INTEGER NOT NULL DEFAULT 0'):
+        db.execute(f'ALTER TABLE deployments ADD COLUMN {column}')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_deployments_environment_id ON deployments(environment, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_deployments_status_id ON deployments(status, id)')
+
+    # Hosts targeted by each deployment and the outcome on each of them
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS deployment_hosts ('
+        ' deployment_id INTEGER NOT NULL,'
+        ' host_name TEXT NOT NULL,'
+        ' status TEXT,'
+        ' PRIMARY KEY (deployment_id, host_name)'
+        ') WITHOUT ROWID'
+    )
+    db.execute('CREATE INDEX IF NOT EXISTS idx_deployment_hosts_host ON deployment_hosts(host_name, deployment_id)')
+    db.execute(
+        'INSERT OR IGNORE INTO deployment_hosts (deployment_id, host_name) '
+        'SELECT d.id, j.value FROM deployments d, json_each(d.hosts) j'
+    )
+
+
+def _migration_deployment_results(db):
+    # Per-host recap of the ansible run, status is ok, changed, failed, unreachable or skipped
+    for column in ('ok INTEGER', 'changed INTEGER', 'failures INTEGER',
+                   'unreachable INTEGER', 'skipped INTEGER', 'message TEXT'):
+        db.execute(f'ALTER TABLE deployment_hosts ADD COLUMN {column}')
+    db.execute("UPDATE deployment_hosts SET status = 'ok' WHERE status = 'secured'")
+    db.execute("UPDATE deployment_hosts SET status = 'failed' WHERE status = 'error'")
+
+
+def _migration_host_revisions(db):
+    # Playbook revision and inventory vars each host last converged on
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS host_revisions ('
+        ' environment TEXT NOT NULL,'
+        ' playbook TEXT NOT NULL,'
+        ' host_name TEXT NOT NULL,'
+        ' revision TEXT NOT NULL,'
+        ' vars_hash TEXT NOT NULL,'
+        ' deployment_id INTEGER,'
+        ' updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,'
+        ' PRIMARY KEY (environment, playbook, host_name)'
+        ') WITHOUT ROWID'
+    )
+    db.execute('CREATE INDEX IF NOT EXISTS idx_host_revisions_host ON host_revisions(environment, host_name)')
+
+
+def _migration_playbook_checks(db):
+    # Validation results keyed by playbook content hash
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS playbook_checks ('
+        ' hash TEXT PRIMARY KEY,'
+        ' ok INTEGER NOT NULL,'
+        ' error TEXT,'
+        ' syntax_checked INTEGER NOT NULL DEFAULT 0,'
+        ' checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'
+        ') WITHOUT ROWID'
+    )
+
+
+def _migration_deployment_processes(db):
+    # ansible-playbook processes a running deployment holds in the global budget
+    db.execute('ALTER TABLE deployments ADD COLUMN processes INTEGER NOT NULL DEFAULT 1')
+
+
+def _migration_deployment_revisions(db):
+    # Playbook revision and per-host vars a running deployment applies, and
+    # the running deployment of the same playbook a queued one must wait for
+    db.execute('ALTER TABLE deployments ADD COLUMN revision TEXT')
+    db.execute('ALTER TABLE deployments ADD COLUMN follows INTEGER')
+    db.execute('ALTER TABLE deployment_hosts ADD COLUMN vars_hash TEXT')
+
+
+# Schema migrations applied in order on top of instance/schema.sql,
+# tracked with PRAGMA user_version
+MIGRATIONS = [
+    (1, _migration_indexes),
+    (2, _migration_host_groups),
+    (3, _migration_host_counters),
+    (4, _migration_stats_rollups),
+    (5, _migration_host_listing),
+    (6, _migration_deployments),
+    (7, _migration_deployment_history),
+    (8, _migration_deployment_results),
+    (9, _migration_host_revisions),
+    (10, _migration_playbook_checks),
+    (11, _migration_deployment_processes),
+    (12, _migration_deployment_revisions),
+]
+
+
+def migrate_db(db):
+    """Apply pending migrations"""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        for target, migration in MIGRATIONS:
+            if target > version:
+                migration(db)
+                db.execute(f'PRAGMA user_version = {target}')
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
 
 def init_db():
     """Initialize database"""
     os.makedirs(current_app.instance_path, exist_ok=True)
     
     db = sqlite3.connect(Config.get_database_path())
-    with current_app.open_resource('schema.sql', mode='r') as f:
+    with current_app.open_instance_resource('schema.sql', mode='r') as f:
         db.cursor().executescript(f.read())
     db.commit()
+    migrate_db(db)
     db.close()
 
+
+def init_db_app(app):
+    """Bring an existing database up to date when the app starts"""
+    with app.app_context():
+        if os.path.exists(Config.get_database_path()):
+            db = sqlite3.connect(Config.get_database_path(), timeout=Config.SQLITE_BUSY_TIMEOUT)
+            try:
+                migrate_db(db)
+            finally:
+                db.close()
+
 @click.command('init-db')
 @with_appcontext
 def init_db_command():
@@ -36,12 +401,80 @@ def init_db_command():
 
 class DatabaseManager:
     """Database operations manager"""
+
+    # Host status after a run by per-host result, failed and unreachable give error
+    RESULT_HOST_STATUS = {'ok': 'secured', 'changed': 'secured', 'skipped': 'pending'}
+    
+    @staticmethod
+    def _hosts_changed(change):
+        # Host changes also move the maintained counters served by /stats
+        DataVersion.bump('hosts', 'stats')
+        EventBus.publish('hosts', change)
     
     @staticmethod
     def get_all_hosts():
         """Get all hosts"""
         db = get_db()
-        return db.execute('SELECT * FROM hosts ORDER BY added_date DESC').fetchall()
+        return db.execute('SELECT * FROM hosts ORDER BY added_date DESC, id DESC').fetchall()
+    
+    @staticmethod
+    def _host_filters(filters):
+        clauses, params = [], []
+        for column in ('environment', 'status', 'security_level'):
+            if filters.get(column):
+                clauses.append(f'{column} = ?')
+                params.append(filters[column])
+        if filters.get('group'):
+            if filters.get('environment'):
+                clauses.append(
+                    'id IN (SELECT host_id FROM host_groups WHERE environment = ? AND group_name = ?)'
+                )
+                params += [filters['environment'], filters['group']]
+            else:
+                clauses.append('id IN (SELECT host_id FROM host_groups WHERE group_name = ?)')
+                params.append(filters['group'])
+        if filters.get('name_prefix'):
+            # Range on the name index instead of a LIKE scan
+            prefix = filters['name_prefix']
+            clauses.append('name >= ? AND name < ?')
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        return clauses, params
+    
+    @staticmethod
+    def query_hosts(filters=None, fields=None, after=None, limit=None):
+        """Get a page of hosts, newest first, after an (added_date, id) keyset"""
+        db = get_db()
+        clauses, params = DatabaseManager._host_filters(filters or {})
+        if after:
+            clauses.append('(added_date, id) < (?, ?)')
+            params += list(after)
+        sql = f"SELECT {', '.join(fields) if fields else '*'} FROM hosts"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY added_date DESC, id DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return db.execute(sql, params).fetchall()
+    
+    @staticmethod
+    def count_hosts(filters=None):
+        """Count hosts matching filters"""
+        db = get_db()
+        clauses, params = DatabaseManager._host_filters(filters or {})
+        sql = 'SELECT COUNT(*) FROM hosts'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return db.execute(sql, params).fetchone()[0]
+    
+    @staticmethod
+    def get_counter(scope, key=''):
+        """Get one maintained host counter"""
+        db = get_db()
+        row = db.execute(
+            'SELECT host_count, secured_count FROM host_counters WHERE scope = ? AND key = ?', (scope, key)
+        ).fetchone()
+        return (row['host_count'], row['secured_count']) if row else (0, 0)
     
     @staticmethod
     def get_host_by_id(host_id):
@@ -49,17 +482,90 @@ class DatabaseManager:
         db = get_db()
         return db.execute('SELECT * FROM hosts WHERE id = ?', (host_id,)).fetchone()
     
+    @staticmethod
+    def get_hosts_by_ids(ids):
+        """Get hosts by IDs"""
+        return DatabaseManager._get_hosts_in('id', ids)
+    
+    @staticmethod
+    def get_hosts_by_names(names):
+        """Get hosts by names"""
+        return DatabaseManager._get_hosts_in('name', names)
+    
+    @staticmethod
+    def get_existing_hosts(names):
+        """(name, environment) of the hosts already stored under one of names, one query per 500 names"""
+        db = get_db()
+        names = list(names)
+        existing = set()
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            existing.update(tuple(row) for row in db.execute(
+                f"SELECT name, environment FROM hosts WHERE name IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return existing
+    
+    @staticmethod
+    def _get_hosts_in(column, values, chunk_size=500):
+        db = get_db()
+        values = list(values)
+        hosts = []
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            hosts += db.execute(
+                f"SELECT * FROM hosts WHERE {column} IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+        return hosts
+    
     @staticmethod
     def add_host(host_data):
         """Add a new host to the database"""
         db = get_db()
-        db.execute(
-            'INSERT INTO hosts (name, ip, environment, security_level, groups, status) '
-            'VALUES (?, ?, ?, ?, ?, ?)',
-            (host_data['name'], host_data['ip'], host_data['environment'], 
-             host_data['security_level'], host_data['groups'], host_data['status'])
-        )
-        db.commit()
+        with db:
+            cursor = db.execute(
+                'INSERT INTO hosts (name, ip, environment, security_level, groups, status) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (host_data['name'], host_data['ip'], host_data['environment'], 
+                 host_data['security_level'], host_data['groups'], host_data['status'])
+            )
+            db.executemany(
+                'INSERT OR IGNORE INTO host_groups (host_id, environment, group_name) VALUES (?, ?, ?)',
+                ((cursor.lastrowid, host_data['environment'], group)
+                 for group in split_groups(host_data['groups']))
+            )
+        DatabaseManager._hosts_changed({'ids': [cursor.lastrowid]})
+    
+    @staticmethod
+    def add_hosts(hosts):
+        """Add many hosts in a single transaction"""
+        db = get_db()
+        memberships = []
+
+        def rows():
+            for h in hosts:
+                memberships.append((h['environment'], split_groups(h['groups'])))
+                yield (h['name'], h['ip'], h['environment'], h['security_level'], h['groups'], h['status'])
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # AUTOINCREMENT ids are allocated sequentially while we hold the write lock
+            seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'hosts'").fetchone()
+            first_id = (seq[0] if seq else 0) + 1
+            db.executemany(
+                'INSERT INTO hosts (name, ip, environment, security_level, groups, status) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows()
+            )
+            db.executemany(
+                'INSERT OR IGNORE INTO host_groups (host_id, environment, group_name) VALUES (?, ?, ?)',
+                ((first_id + i, environment, group)
+                 for i, (environment, groups) in enumerate(memberships) for group in groups)
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        DatabaseManager._hosts_changed({'ids': list(range(first_id, first_id + len(memberships)))})
     
     @staticmethod
     def update_host_status(host_name, status):
@@ -67,14 +573,19 @@ class DatabaseManager:
         db = get_db()
         db.execute("UPDATE hosts SET status = ? WHERE name = ?", (status, host_name))
         db.commit()
+        DatabaseManager._hosts_changed({'names': [host_name]})
     
     @staticmethod
     def update_hosts_status(host_names, status):
         """Update multiple hosts status"""
         db = get_db()
-        for host_name in host_names:
-            db.execute("UPDATE hosts SET status = ? WHERE name = ?", (status, host_name))
+        host_names = list(host_names)
+        db.executemany(
+            "UPDATE hosts SET status = ? WHERE name = ?",
+            ((status, host_name) for host_name in host_names)
+        )
         db.commit()
+        DatabaseManager._hosts_changed({'names': host_names})
     
     @staticmethod
     def delete_host(host_id):
@@ -82,8 +593,14 @@ class DatabaseManager:
         db = get_db()
         host = DatabaseManager.get_host_by_id(host_id)
         if host:
-            db.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
-            db.commit()
+            with db:
+                db.execute('DELETE FROM host_groups WHERE host_id = ?', (host_id,))
+                db.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
+                db.execute(
+                    'DELETE FROM host_revisions WHERE environment = ? AND host_name = ?',
+                    (host['environment'], host['name'])
+                )
+            DatabaseManager._hosts_changed({'deleted': [host_id]})
             return dict(host)
         return None
     
@@ -100,26 +617,56 @@ class DatabaseManager:
         """Get hosts of specific group in an environment"""
         db = get_db()
         return db.execute(
-            "SELECT name FROM hosts WHERE groups LIKE ? AND environment = ?",
-            (f'%{group}%', environment)
+            "SELECT h.name FROM host_groups hg JOIN hosts h ON h.id = hg.host_id "
+            "WHERE hg.environment = ? AND hg.group_name = ?",
+            (environment, group)
         ).fetchall()
     
     @staticmethod
     def get_latest_stats():
         """Get the latest statistics"""
         db = get_db()
-        return db.execute('SELECT * FROM stats ORDER BY timestamp DESC LIMIT 1').fetchone()
+        return db.execute('SELECT * FROM stats ORDER BY timestamp DESC, id DESC LIMIT 1').fetchone()
+    
+    @staticmethod
+    def vulnerabilities_count(unsecured_hosts):
+        """Estimated vulnerabilities for a number of unsecured hosts"""
+        return max(1, unsecured_hosts // 3) if unsecured_hosts > 0 else 0
+    
+    @staticmethod
+    def get_counters():
+        """Get the maintained host counters, by scope then key"""
+        db = get_db()
+        counters = {'total': {}, 'environment': {}, 'group': {}, 'security_level': {}}
+        for row in db.execute('SELECT * FROM host_counters WHERE host_count > 0'):
+            counters.setdefault(row['scope'], {})[row['key']] = {
+                'host_count': row['host_count'],
+                'secured_count': row['secured_count'],
+                'unsecured_count': row['host_count'] - row['secured_count']
+            }
+        return counters
+    
+    @staticmethod
+    def get_current_stats():
+        """Get live statistics and their breakdown from the maintained counters"""
+        counters = DatabaseManager.get_counters()
+        total = counters.pop('total').get('', {'host_count': 0, 'secured_count': 0, 'unsecured_count': 0})
+        latest = DatabaseManager.get_latest_stats()
+        return {
+            **total,
+            'vulnerabilities_count': DatabaseManager.vulnerabilities_count(total['unsecured_count']),
+            'timestamp': latest['timestamp'] if latest else None,
+            'breakdown': counters
+        }
     
     @staticmethod
     def update_stats():
         """Update statistics"""
         db = get_db()
         
-        # Calculate statistics
-        total_hosts = db.execute('SELECT COUNT(*) FROM hosts').fetchone()[0]
-        secured_hosts = db.execute("SELECT COUNT(*) FROM hosts WHERE status = 'secured'").fetchone()[0]
-        unsecured_hosts = total_hosts - secured_hosts
-        vulnerabilities = max(1, unsecured_hosts // 3) if unsecured_hosts > 0 else 0
+        # Read the maintained counters instead of scanning hosts
+        total_hosts, secured_hosts = DatabaseManager.get_counter('total')
+        vulnerabilities = DatabaseManager.vulnerabilities_count(total_hosts - secured_hosts)
         
         # Insert the new statistics
         db.execute(
@@ -127,4 +674,529 @@ class DatabaseManager:
             'VALUES (?, ?, ?)',
             (total_hosts, secured_hosts, vulnerabilities)
         )
-        db.commit()
\ No newline at end of file
+        db.commit()
+        DataVersion.bump('stats')
+        EventBus.publish('stats')
+    
+    @staticmethod
+    def compact_stats(raw_retention, resolutions, now):
+        """Roll closed buckets up into coarser resolutions and prune expired samples
+
+        resolutions is an ordered list of (name, step, retention) tuples,
+        each one fed from the previous one and the first from the raw stats table.
+        """
+        db = get_db()
+        sums = ', '.join(f'SUM({m}_sum), MIN({m}_min), MAX({m}_max)' for m in STATS_METRICS)
+        raw = ', '.join(f'SUM({m}), MIN({m}), MAX({m})' for m in STATS_METRICS)
+        columns = ', '.join(f'{m}_sum, {m}_min, {m}_max' for m in STATS_METRICS)
+        merge = ', '.join(
+            f'{m}_sum = {m}_sum + excluded.{m}_sum, '
+            f'{m}_min = MIN({m}_min, excluded.{m}_min), '
+            f'{m}_max = MAX({m}_max, excluded.{m}_max)'
+            for m in STATS_METRICS
+        )
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            watermarks = dict(db.execute('SELECT resolution, watermark FROM stats_rollup_state').fetchall())
+            source = None
+            for name, step, retention in resolutions:
+                start = watermarks.get(name, 0)
+                end = (now // step) * step
+                if end > start:
+                    if source is None:
+                        db.execute(
+                            f"INSERT INTO stats_rollups (resolution, bucket, samples, {columns}) "
+                            f"SELECT ?, (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ? AS b, COUNT(*), {raw} "
+                            f"FROM stats WHERE timestamp >= datetime(?, 'unixepoch') "
+                            f"AND timestamp < datetime(?, 'unixepoch') GROUP BY b "
+                            f"ON CONFLICT (resolution, bucket) DO UPDATE SET samples = samples + excluded.samples, {merge}",
+                            (name, step, step, start, end)
+                        )
+                    else:
+                        db.execute(
+                            f"INSERT INTO stats_rollups (resolution, bucket, samples, {columns}) "
+                            f"SELECT ?, (bucket / ?) * ? AS b, SUM(samples), {sums} "
+                            f"FROM stats_rollups WHERE resolution = ? AND bucket >= ? AND bucket < ? GROUP BY b "
+                            f"ON CONFLICT (resolution, bucket) DO UPDATE SET samples = samples + excluded.samples, {merge}",
+                            (name, step, step, source, start, end)
+                        )
+                    db.execute(
+                        'INSERT INTO stats_rollup_state (resolution, watermark) VALUES (?, ?) '
+                        'ON CONFLICT (resolution) DO UPDATE SET watermark = excluded.watermark',
+                        (name, end)
+                    )
+                    watermarks[name] = end
+                source = name
+
+            # Only prune what has already been rolled up into the next resolution
+            db.execute(
+                "DELETE FROM stats WHERE timestamp < datetime(?, 'unixepoch') "
+                "AND timestamp < datetime(?, 'unixepoch') AND id < (SELECT MAX(id) FROM stats)",
+                (now - raw_retention, watermarks.get(resolutions[0][0], 0))
+            )
+            for i, (name, step, retention) in enumerate(resolutions):
+                limit = now
+                if i + 1 < len(resolutions):
+                    limit = watermarks.get(resolutions[i + 1][0], 0)
+                db.execute(
+                    'DELETE FROM stats_rollups WHERE resolution = ? AND bucket < ? AND bucket < ?',
+                    (name, now - retention, limit)
+                )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def get_stats_watermark(resolution):
+        """Get the end of the last bucket rolled up at a resolution"""
+        db = get_db()
+        row = db.execute(
+            'SELECT watermark FROM stats_rollup_state WHERE resolution = ?', (resolution,)
+        ).fetchone()
+        return row['watermark'] if row else 0
+    
+    @staticmethod
+    def get_stats_rollups(resolution, start, end, step):
+        """Get rolled-up samples between two epochs, regrouped by step seconds"""
+        db = get_db()
+        sums = ', '.join(
+            f'SUM({m}_sum) AS {m}_sum, MIN({m}_min) AS {m}_min, MAX({m}_max) AS {m}_max'
+            for m in STATS_METRICS
+        )
+        return db.execute(
+            f'SELECT (bucket / ?) * ? AS bucket, SUM(samples) AS samples, {sums} '
+            f'FROM stats_rollups WHERE resolution = ? AND bucket >= ? AND bucket < ? '
+            f'GROUP BY 1 ORDER BY 1',
+            (step, step, resolution, start, end)
+        ).fetchall()
+    
+    @staticmethod
+    def get_stats_samples(start, end, step):
+        """Get raw samples between two epochs, grouped by step seconds"""
+        db = get_db()
+        sums = ', '.join(
+            f'SUM({m}) AS {m}_sum, MIN({m}) AS {m}_min, MAX({m}) AS {m}_max'
+            for m in STATS_METRICS
+        )
+        return db.execute(
+            f"SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ? AS bucket, "
+            f"COUNT(*) AS samples, {sums} FROM stats "
+            f"WHERE timestamp >= datetime(?, 'unixepoch') AND timestamp < datetime(?, 'unixepoch') "
+            f"GROUP BY 1 ORDER BY 1",
+            (step, step, start, end)
+        ).fetchall()
+    
+    @staticmethod
+    def enqueue_deployment(environment, playbook, hosts, priority, max_queued, revision=None, vars_hashes=None):
+        """Queue a deployment, coalescing it with jobs of the same playbook and environment
+
+        Hosts a running job is already deploying with the same playbook revision
+        and the same vars are dropped and the rest joins the queued job if there
+        is one. Hosts a running job deploys with older content are queued again,
+        to run once that job is over. Returns (deployment ID, coalesced, added,
+        covered) with the hosts this request put in the job and the ones a job
+        already deploys with this content, None when a new job is needed and
+        the queue is full.
+        """
+        db = get_db()
+        hosts = list(dict.fromkeys(hosts))
+        vars_hashes = vars_hashes or {}
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = db.execute(
+                "SELECT id, hosts, status, priority, revision, follows FROM deployments "
+                "WHERE environment = ? AND playbook = ? AND status IN ('queued', 'running') ORDER BY id",
+                (environment, playbook)
+            ).fetchall()
+
+            running = []
+            for job in jobs:
+                if job['status'] != 'running':
+                    continue
+                covered = set()
+                # A job that has not recorded its revision yet is treated as outdated
+                if revision is not None and job['revision'] == revision:
+                    applied = dict(db.execute(
+                        'SELECT host_name, vars_hash FROM deployment_hosts WHERE deployment_id = ?', (job['id'],)
+                    ).fetchall())
+                    covered = {name for name in hosts
+                               if applied.get(name) is not None and applied[name] == vars_hashes.get(name)}
+                running.append((job['id'], covered, set(json.loads(job['hosts']))))
+
+            remaining = [name for name in hosts if not any(name in covered for _, covered, _ in running)]
+            if not remaining:
+                # Everything is already being deployed, attach to the run covering most hosts
+                deployment_id = max(running, key=lambda job: len(job[1]))[0]
+                db.execute('COMMIT')
+                return deployment_id, True, [], hosts
+
+            # Never run two jobs on the same hosts at once, wait for the outdated runs
+            follows = max((job_id for job_id, _, job_hosts in running if not job_hosts.isdisjoint(remaining)),
+                          default=None)
+
+            queued = next((job for job in jobs if job['status'] == 'queued'), None)
+            if queued is not None:
+                deployment_id = queued['id']
+                queued_hosts = json.loads(queued['hosts'])
+                queued_set = set(queued_hosts)
+                added = [name for name in remaining if name not in queued_set]
+                follows = max((job_id for job_id in (queued['follows'], follows) if job_id), default=None)
+                db.execute(
+                    'UPDATE deployments SET hosts = ?, priority = MAX(priority, ?), follows = ? WHERE id = ?',
+                    (json.dumps(queued_hosts + added), priority, follows, deployment_id)
+                )
+            else:
+                queue_size = db.execute("SELECT COUNT(*) FROM deployments WHERE status = 'queued'").fetchone()[0]
+                if queue_size >= max_queued:
+                    db.execute('ROLLBACK')
+                    return None
+                cursor = db.execute(
+                    'INSERT INTO deployments (environment, playbook, hosts, priority, follows) VALUES (?, ?, ?, ?, ?)',
+                    (environment, playbook, json.dumps(remaining), priority, follows)
+                )
+                deployment_id = cursor.lastrowid
+                added = remaining
+
+            db.executemany(
+                'INSERT OR IGNORE INTO deployment_hosts (deployment_id, host_name) VALUES (?, ?)',
+                [(deployment_id, name) for name in added]
+            )
+            db.execute('COMMIT')
+            added_set = set(added)
+            return deployment_id, queued is not None, added, [name for name in hosts if name not in added_set]
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def get_host_revisions(environment, playbook, host_names, chunk_size=500):
+        """Map host names to the (revision, vars hash) they last converged on with a playbook"""
+        db = get_db()
+        host_names = list(host_names)
+        revisions = {}
+        for i in range(0, len(host_names), chunk_size):
+            chunk = host_names[i:i + chunk_size]
+            rows = db.execute(
+                'SELECT host_name, revision, vars_hash FROM host_revisions '
+                f"WHERE environment = ? AND playbook = ? AND host_name IN ({','.join('?' * len(chunk))})",
+                [environment, playbook] + chunk
+            ).fetchall()
+            revisions.update((row[0], (row[1], row[2])) for row in rows)
+        return revisions
+    
+    @staticmethod
+    def record_host_revisions(environment, playbook, revision, converged, failed, deployment_id=None):
+        """Remember what converged hosts got and forget failed ones so they are targeted again
+
+        converged maps host names to their vars hash.
+        """
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT INTO host_revisions (environment, playbook, host_name, revision, vars_hash, deployment_id) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (environment, playbook, host_name) DO UPDATE SET '
+                'revision = excluded.revision, vars_hash = excluded.vars_hash, '
+                'deployment_id = excluded.deployment_id, updated_at = CURRENT_TIMESTAMP',
+                ((environment, playbook, name, revision, vars_hash, deployment_id)
+                 for name, vars_hash in converged.items())
+            )
+            db.executemany(
+                'DELETE FROM host_revisions WHERE environment = ? AND playbook = ? AND host_name = ?',
+                ((environment, playbook, name) for name in failed)
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def get_playbook_check(content_hash):
+        db = get_db()
+        return db.execute(
+            'SELECT hash, ok, error, syntax_checked, checked_at FROM playbook_checks WHERE hash = ?',
+            (content_hash,)
+        ).fetchone()
+    
+    @staticmethod
+    def save_playbook_check(content_hash, error, syntax_checked):
+        db = get_db()
+        db.execute(
+            'INSERT OR REPLACE INTO playbook_checks (hash, ok, error, syntax_checked) VALUES (?, ?, ?, ?)',
+            (content_hash, int(error is None), error, int(syntax_checked))
+        )
+        db.commit()
+    
+    @staticmethod
+    def get_deployment(deployment_id):
+        """Get deployment by ID"""
+        db = get_db()
+        return db.execute('SELECT * FROM deployments WHERE id = ?', (deployment_id,)).fetchone()
+    
+    @staticmethod
+    def get_deployment_hosts(deployment_id):
+        """Hosts targeted by a deployment with their outcome"""
+        db = get_db()
+        return db.execute(
+            'SELECT host_name, status, ok, changed, failures, unreachable, skipped, message '
+            'FROM deployment_hosts WHERE deployment_id = ? ORDER BY host_name',
+            (deployment_id,)
+        ).fetchall()
+    
+    @staticmethod
+    def get_failed_deployment_hosts(deployment_id):
+        """Names of the hosts a deployment failed on or could not reach"""
+        db = get_db()
+        return [row[0] for row in db.execute(
+            "SELECT host_name FROM deployment_hosts WHERE deployment_id = ? "
+            "AND status IN ('failed', 'unreachable') ORDER BY host_name",
+            (deployment_id,)
+        ).fetchall()]
+    
+    @staticmethod
+    def record_deployment_results(deployment_id, results):
+        """Store the per-host results of a run and the resulting host statuses in one transaction
+
+        results maps host names to dicts with status, the recap counts and message.
+        """
+        db = get_db()
+        names = list(results)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if deployment_id is not None:
+                db.executemany(
+                    'UPDATE deployment_hosts SET status = ?, ok = ?, changed = ?, failures = ?, '
+                    'unreachable = ?, skipped = ?, message = ? WHERE deployment_id = ? AND host_name = ?',
+                    ((r['status'], r.get('ok'), r.get('changed'), r.get('failures'), r.get('unreachable'),
+                      r.get('skipped'), r.get('message'), deployment_id, name) for name, r in results.items())
+                )
+            db.executemany(
+                'UPDATE hosts SET status = ? WHERE name = ?',
+                ((DatabaseManager.RESULT_HOST_STATUS.get(r['status'], 'error'), name)
+                 for name, r in results.items())
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        DatabaseManager._hosts_changed({'names': names})
+    
+    @staticmethod
+    def list_deployments(filters, before=None, limit=100):
+        """Deployments from the most recent, filtered by environment or status"""
+        db = get_db()
+        clauses, params = [], []
+        for column in ('environment', 'status'):
+            if filters.get(column):
+                clauses.append(f'{column} = ?')
+                params.append(filters[column])
+        if before is not None:
+            clauses.append('id < ?')
+            params.append(before)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        return db.execute(
+            f'SELECT * FROM deployments {where}ORDER BY id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+    
+    @staticmethod
+    def count_deployments(filters):
+        db = get_db()
+        clauses, params = [], []
+        for column in ('environment', 'status'):
+            if filters.get(column):
+                clauses.append(f'{column} = ?')
+                params.append(filters[column])
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return db.execute(f'SELECT COUNT(*) FROM deployments{where}', params).fetchone()[0]
+    
+    @staticmethod
+    def get_queue_position(deployment_id):
+        """Number of queued deployments that will be picked before this one"""
+        db = get_db()
+        return db.execute(
+            "SELECT COUNT(*) FROM deployments d, deployments me WHERE me.id = ? AND d.status = 'queued' "
+            "AND (d.priority > me.priority OR (d.priority = me.priority AND d.id < me.id))",
+            (deployment_id,)
+        ).fetchone()[0]
+    
+    @staticmethod
+    def claim_deployment(worker, max_running, max_per_environment):
+        """Move the next runnable queued deployment to running, within the concurrency caps
+
+        max_running bounds the ansible-playbook processes of all running
+        deployments, max_per_environment the deployments of one environment.
+        """
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute(
+                "SELECT environment, COUNT(*), SUM(processes) FROM deployments "
+                "WHERE status = 'running' GROUP BY environment"
+            ).fetchall()
+            if sum(row[2] for row in rows) >= max_running:
+                db.execute('ROLLBACK')
+                return None
+            running = {row[0]: row[1] for row in rows}
+
+            saturated = [env for env, count in running.items() if count >= max_per_environment]
+            job = db.execute(
+                "SELECT * FROM deployments q WHERE status = 'queued' "
+                f"AND environment NOT IN ({','.join('?' * len(saturated))}) "
+                "AND NOT EXISTS (SELECT 1 FROM deployments r WHERE r.status = 'running' "
+                "AND r.environment = q.environment AND r.playbook = q.playbook AND r.id <= q.follows) "
+                "ORDER BY priority DESC, id LIMIT 1",
+                saturated
+            ).fetchone()
+            if job is None:
+                db.execute('ROLLBACK')
+                return None
+
+            db.execute(
+                "UPDATE deployments SET status = 'running', worker = ?, started_at = CURRENT_TIMESTAMP, "
+                "heartbeat = CURRENT_TIMESTAMP, attempts = attempts + 1, processes = 1 WHERE id = ?",
+                (worker, job['id'])
+            )
+            db.execute('COMMIT')
+            return job
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def reserve_deployment_processes(deployment_id, wanted, max_running):
+        """Grow a running deployment to up to wanted processes within the global budget, return the grant"""
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            used = db.execute(
+                "SELECT COALESCE(SUM(processes), 0) FROM deployments WHERE status = 'running' AND id != ?",
+                (deployment_id,)
+            ).fetchone()[0]
+            # The process taken when the job was claimed is never given back
+            granted = max(1, min(wanted, max_running - used))
+            db.execute('UPDATE deployments SET processes = ? WHERE id = ?', (granted, deployment_id))
+            db.execute('COMMIT')
+            return granted
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def set_deployment_revision(deployment_id, revision, vars_hashes):
+        """Record the playbook revision and host vars a deployment runs with"""
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('UPDATE deployments SET revision = ? WHERE id = ?', (revision, deployment_id))
+            db.executemany(
+                'UPDATE deployment_hosts SET vars_hash = ? WHERE deployment_id = ? AND host_name = ?',
+                ((vars_hash, deployment_id, name) for name, vars_hash in vars_hashes.items())
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def set_deployment_log(deployment_id, log_path):
+        db = get_db()
+        db.execute('UPDATE deployments SET log_path = ? WHERE id = ?', (log_path, deployment_id))
+        db.commit()
+    
+    @staticmethod
+    def heartbeat_deployments(worker):
+        """Mark the deployments run by a worker as still alive"""
+        db = get_db()
+        db.execute(
+            "UPDATE deployments SET heartbeat = CURRENT_TIMESTAMP WHERE worker = ? AND status = 'running'",
+            (worker,)
+        )
+        db.commit()
+    
+    @staticmethod
+    def finish_deployment(deployment_id, status, exit_code=None, host_status=None):
+        """Record the outcome of a deployment"""
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'UPDATE deployments SET status = ?, exit_code = ?, finished_at = CURRENT_TIMESTAMP, '
+                "duration = (julianday('now') - julianday(started_at)) * 86400 WHERE id = ?",
+                (status, exit_code, deployment_id)
+            )
+            if host_status:
+                db.execute(
+                    'UPDATE deployment_hosts SET status = ? WHERE deployment_id = ? AND status IS NULL',
+                    (host_status, deployment_id)
+                )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    
+    @staticmethod
+    def cancel_deployment(deployment_id):
+        """Cancel a deployment still waiting in the queue"""
+        db = get_db()
+        cursor = db.execute(
+            "UPDATE deployments SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'queued'",
+            (deployment_id,)
+        )
+        db.commit()
+        return cursor.rowcount > 0
+    
+    @staticmethod
+    def recover_deployments(stale_after, max_attempts):
+        """Requeue or fail running deployments whose worker stopped sending heartbeats
+
+        Returns the host names to reset: (requeued, failed).
+        """
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            orphans = db.execute(
+                "SELECT id, hosts, attempts FROM deployments WHERE status = 'running' "
+                "AND (heartbeat IS NULL OR heartbeat < datetime('now', ?))",
+                (f'-{int(stale_after)} seconds',)
+            ).fetchall()
+
+            requeued, failed = [], []
+            for job in orphans:
+                if job['attempts'] < max_attempts:
+                    db.execute(
+                        "UPDATE deployments SET status = 'queued', worker = NULL, started_at = NULL, "
+                        'heartbeat = NULL WHERE id = ?',
+                        (job['id'],)
+                    )
+                    requeued += json.loads(job['hosts'])
+                else:
+                    db.execute(
+                        "UPDATE deployments SET status = 'failed', finished_at = CURRENT_TIMESTAMP, "
+                        "duration = (julianday('now') - julianday(started_at)) * 86400 WHERE id = ?",
+                        (job['id'],)
+                    )
+                    db.execute(
+                        "UPDATE deployment_hosts SET status = 'failed' WHERE deployment_id = ? AND status IS NULL",
+                        (job['id'],)
+                    )
+                    failed += json.loads(job['hosts'])
+
+            # Hosts left deploying by a job that no longer runs, e.g. before the queue existed
+            failed += [row[0] for row in db.execute(
+                "SELECT name FROM hosts WHERE status = 'deploying' AND name NOT IN ("
+                " SELECT dh.host_name FROM deployment_hosts dh JOIN deployments d ON d.id = dh.deployment_id"
+                " WHERE d.status = 'running')"
+            ).fetchall() if row[0] not in requeued]
+            db.execute('COMMIT')
+            return requeued, failed
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+
+# Every public DatabaseManager call is timed for /metrics
+timed_methods(DatabaseManager, DB_DURATION)
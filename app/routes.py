@@ -1,9 +1,18 @@
-from flask import render_template, request, jsonify, Response
+import time
+from flask import render_template, request, jsonify, Response, send_file, stream_with_context, url_for
+from config import Config
 from database import DatabaseManager
 from services.deployment_service import DeploymentService
 from services.event_service import EventService
-from services.inventory_service import InventoryService
+from services.fact_cache_service import FactCacheService
+from services.host_service import HostService
+from services.import_service import HostImportService
+from services.log_service import LogTailService
+from services.metrics_service import DEPLOYMENTS, MetricsRegistry
 from services.playbook_service import PlaybookService
+from services.profiling_service import ProfilingService
+from services.response_cache import cached_response
+from services.stats_service import StatsService
 from services.validation_service import ValidationService
 
 
@@ -19,15 +28,33 @@ def register_routes(app):
     @app.route('/events')
     def events():
         """Flux d'événements SSE"""
-        return Response(EventService.get_event_stream(), mimetype='text/event-stream')
+        return Response(
+            stream_with_context(EventService.get_event_stream(
+                request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+            )),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
     
     # === ROUTES FOR HOSTS ===
     
     @app.route('/hosts')
+    @cached_response('hosts')
     def list_hosts():
-        """Lister tous les hôtes"""
-        hosts = DatabaseManager.get_all_hosts()
-        return jsonify([dict(host) for host in hosts])
+        """Lister les hôtes (pagination par curseur, filtres et projection)"""
+        try:
+            hosts, total, next_cursor = HostService.list_hosts(request.args)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        response = jsonify(hosts)
+        response.headers['X-Total-Count'] = str(total)
+        if next_cursor:
+            args = request.args.to_dict()
+            args['cursor'] = next_cursor
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for("list_hosts", **args)}>; rel="next"'
+        return response
     
     @app.route('/add-host', methods=['POST'])
     def add_host():
@@ -55,8 +82,8 @@ def register_routes(app):
             # Update statistics
             DatabaseManager.update_stats()
         
-            # Save into the inventory
-            InventoryService.save_host_to_inventory(host_data)
+            # Facts cached for an earlier host of the same name are stale
+            FactCacheService.invalidate([host_data['name']])
             
             return jsonify({
                 'status': 'success',
@@ -68,6 +95,58 @@ def register_routes(app):
                 'message': f"Erreur: {str(e)}"
             }), 500
     
+    @app.route('/hosts/bulk', methods=['POST'])
+    def bulk_import_hosts():
+        """Bulk import hosts from a CSV or NDJSON upload"""
+        try:
+            upload = request.files.get('file')
+            if upload:
+                fmt = HostImportService.detect_format(
+                    request.args.get('format'), upload.filename, upload.mimetype
+                )
+                stream = upload.stream
+            else:
+                fmt = HostImportService.detect_format(
+                    request.args.get('format'), content_type=request.content_type
+                )
+                stream = request.stream
+
+            result = HostImportService.import_hosts(stream, fmt)
+
+            if result['errors'] and not result['imported']:
+                status, code = 'error', 400
+            elif result['errors']:
+                status, code = 'partial', 200
+            else:
+                status, code = 'success', 200
+            return jsonify({
+                'status': status,
+                'message': f"{result['imported']} hôte(s) importé(s)",
+                'imported': result['imported'],
+                'errors': result['errors']
+            }), code
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except Exception as e:
+            return jsonify({
+                'status': 'error',
+                'message': f"Erreur lors de l'import: {str(e)}"
+            }), 500
+    
+    @app.route('/hosts/<int:host_id>/facts')
+    def host_facts(host_id):
+        """Faits Ansible en cache d'un hôte (OS, noyau...) sans connexion SSH"""
+        host = DatabaseManager.get_host_by_id(host_id)
+        if host is None:
+            return jsonify({'status': 'error', 'message': 'Hôte non trouvé'}), 404
+        facts = FactCacheService.get_facts(host['name'])
+        if facts is None:
+            return jsonify({
+                'status': 'error',
+                'message': "Aucun fait en cache pour cet hôte, ils seront collectés au prochain déploiement"
+            }), 404
+        return jsonify({'status': 'success', 'host': host['name'], **facts})
+    
     @app.route('/host/<int:host_id>', methods=['DELETE'])
     def delete_host(host_id):
         """Delete an host"""
@@ -80,8 +159,7 @@ def register_routes(app):
             # Update statistics
             DatabaseManager.update_stats()
             
-            # Remove from inventory
-            InventoryService.remove_host_from_inventory(host_data)
+            FactCacheService.invalidate([host_data['name']])
             
             return jsonify({
                 'status': 'success',
@@ -96,13 +174,15 @@ def register_routes(app):
     # === ROUTES FOR PLAYBOOKS ===
     
     @app.route('/playbooks', methods=['GET'])
+    @cached_response('playbooks')
     def list_playbooks():
         """List all playbooks"""
         try:
-            playbooks = PlaybookService.list_playbooks()
+            catalog = PlaybookService.get_catalog()
             return jsonify({
                 "status": "success",
-                "playbooks": playbooks
+                "playbooks": [entry['name'] for entry in catalog],
+                "catalog": catalog
             })
         except Exception as e:
             return jsonify({
@@ -173,19 +253,35 @@ def register_routes(app):
             playbook = data.get('playbook', 'site.yml')
             target_hosts = data.get('hosts', [])
             target_group = data.get('group', None)
+            priority = data.get('priority', 0)
+            if not isinstance(priority, int):
+                raise ValueError('La priorité doit être un entier')
+            incremental = data.get('incremental', False)
+            if not isinstance(incremental, bool):
+                raise ValueError('incremental doit être un booléen')
             
             # Determine the target hosts
             target_hosts = DeploymentService.get_target_hosts(
                 environment, target_hosts, target_group
             )
             
-            # Start the deployment
-            DeploymentService.start_deployment(environment, playbook, target_hosts)
+            # Queue the deployment, identical pending work is coalesced
+            job = DeploymentService.start_deployment(environment, playbook, target_hosts, priority, incremental)
+            if job is None:
+                return jsonify({
+                    'status': 'success',
+                    'message': f"Les {len(target_hosts)} hôte(s) sont déjà à jour avec {playbook}",
+                    'job_id': None,
+                    'skipped': len(target_hosts)
+                })
             
             return jsonify({
                 'status': 'success',
-                'message': f"Déploiement de {playbook} sur {len(target_hosts)} hôte(s) démarré!"
-            })
+                'message': DeploymentService.describe_queued(
+                    job, job['added'], job['covered'], f"Déploiement de {playbook}"
+                ),
+                **job
+            }), 202
         except ValueError as e:
             return jsonify({
                 'status': 'error',
@@ -197,10 +293,147 @@ def register_routes(app):
                 'message': f"Échec du déploiement: {str(e)}"
             }), 500
     
+    @app.route('/deployments')
+    def list_deployments():
+        """Historique des déploiements (pagination par curseur)"""
+        try:
+            deployments, total, next_cursor = DeploymentService.list_deployments(request.args)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        response = jsonify(deployments)
+        response.headers['X-Total-Count'] = str(total)
+        if next_cursor:
+            args = request.args.to_dict()
+            args['cursor'] = next_cursor
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for("list_deployments", **args)}>; rel="next"'
+        return response
+    
+    @app.route('/deployments/<int:deployment_id>', methods=['GET'])
+    def get_deployment(deployment_id):
+        """Get the state of a deployment job"""
+        deployment = DeploymentService.get_deployment(deployment_id)
+        if deployment is None:
+            return jsonify({'status': 'error', 'message': 'Déploiement non trouvé'}), 404
+        return jsonify({'status': 'success', 'deployment': deployment})
+    
+    @app.route('/deployments/<int:deployment_id>/log')
+    def deployment_log(deployment_id):
+        """Suivre la sortie d'ansible-playbook en direct, reprise à partir d'un offset"""
+        if DatabaseManager.get_deployment(deployment_id) is None:
+            return jsonify({'status': 'error', 'message': 'Déploiement non trouvé'}), 404
+        offset = request.headers.get('Last-Event-ID') or request.args.get('offset') or '0'
+        if not offset.isdigit():
+            return jsonify({'status': 'error', 'message': 'Offset invalide'}), 400
+        return Response(
+            stream_with_context(LogTailService.get_log_stream(app, deployment_id, int(offset))),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    @app.route('/deployments/<int:deployment_id>/retry', methods=['POST'])
+    def retry_deployment(deployment_id):
+        """Relancer un déploiement sur ses hôtes en échec uniquement"""
+        if DatabaseManager.get_deployment(deployment_id) is None:
+            return jsonify({'status': 'error', 'message': 'Déploiement non trouvé'}), 404
+        try:
+            data = request.get_json(silent=True) or {}
+            priority = data.get('priority', 0)
+            if not isinstance(priority, int):
+                raise ValueError('La priorité doit être un entier')
+            job, hosts = DeploymentService.retry_deployment(deployment_id, priority)
+            return jsonify({
+                'status': 'success',
+                'message': DeploymentService.describe_queued(job, job['added'], job['covered'], 'Relance'),
+                **job,
+                'hosts': hosts
+            }), 202
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': f"Erreur: {str(e)}"}), 500
+    
+    @app.route('/deployments/<int:deployment_id>', methods=['DELETE'])
+    def cancel_deployment(deployment_id):
+        """Cancel a queued deployment job"""
+        if not DatabaseManager.cancel_deployment(deployment_id):
+            return jsonify({
+                'status': 'error',
+                'message': "Déploiement introuvable ou déjà démarré"
+            }), 409
+        job = DatabaseManager.get_deployment(deployment_id)
+        DEPLOYMENTS.inc(job['environment'], job['playbook'], 'cancelled')
+        return jsonify({'status': 'success', 'message': f"Déploiement {deployment_id} annulé."})
+    
     # === ROUTES FOR STATISTICS ===
     
     @app.route('/stats')
+    @cached_response('stats')
     def get_stats():
         """Get realtime statistics"""
-        stats = DatabaseManager.get_latest_stats()
-        return jsonify(dict(stats)) if stats else jsonify({})
\ No newline at end of file
+        return jsonify(DatabaseManager.get_current_stats())
+    
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics of every worker process"""
+        return Response(
+            MetricsRegistry.render(Config.get_metrics_path()),
+            mimetype='text/plain; version=0.0.4'
+        )
+    
+    @app.route('/stats/history')
+    def get_stats_history():
+        """Get statistics over a time range"""
+        try:
+            now = int(time.time())
+            end = StatsService.parse_time(request.args.get('to'), now)
+            start = StatsService.parse_time(request.args.get('from'), end - 86400)
+            step = StatsService.parse_step(request.args.get('step'))
+            return jsonify({
+                'status': 'success',
+                **StatsService.get_history(start, end, step, now)
+            })
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    # === ROUTES FOR PROFILING ===
+    
+    def debug_denied():
+        """Error response unless the request carries the profiling token"""
+        if not Config.PROFILING_TOKEN:
+            return jsonify({'status': 'error', 'message': 'Profilage désactivé'}), 404
+        if not ProfilingService.authorized():
+            return jsonify({'status': 'error', 'message': 'Jeton de profilage invalide'}), 403
+        return None
+    
+    @app.route('/debug/slow')
+    def list_slow_requests():
+        """Requêtes lentes ou profilées enregistrées"""
+        denied = debug_denied()
+        if denied:
+            return denied
+        return jsonify(ProfilingService.list_records())
+    
+    @app.route('/debug/slow/<record_id>')
+    def get_slow_request(record_id):
+        """Requête enregistrée avec son profil et ses requêtes SQL"""
+        denied = debug_denied()
+        if denied:
+            return denied
+        record = ProfilingService.get_record(record_id)
+        if record is None:
+            return jsonify({'status': 'error', 'message': 'Requête introuvable'}), 404
+        return jsonify(record)
+    
+    @app.route('/debug/slow/<record_id>/profile')
+    def get_slow_request_profile(record_id):
+        """Profil cProfile brut d'une requête enregistrée"""
+        denied = debug_denied()
+        if denied:
+            return denied
+        path = ProfilingService.get_profile_path(record_id)
+        if path is None:
+            return jsonify({'status': 'error', 'message': 'Profil introuvable'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{record_id}.prof")
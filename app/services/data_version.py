@@ -0,0 +1,77 @@
+import os
+import mmap
+import fcntl
+import struct
+import threading
+from config import Config
+
+
+class DataVersion:
+    """Data version counters shared by every worker process
+
+    Counters live in a small memory-mapped file of the instance folder:
+    reading one is a memory access, bumping one takes a file lock. A random
+    generation is drawn when the file is created, so versions of a new
+    file never collide with ones handed out before.
+    """
+    NAMESPACES = ('generation', 'hosts', 'stats', 'playbooks')
+    SLOT = struct.Struct('<Q')
+
+    _maps = {}
+    _lock = threading.Lock()
+    # Bumps made by this process, to tell them from the ones of other processes
+    _local = {}
+
+    @staticmethod
+    def _map():
+        path = Config.get_data_version_path()
+        mapped = DataVersion._maps.get(path)
+        if mapped is not None:
+            return mapped
+
+        with DataVersion._lock:
+            mapped = DataVersion._maps.get(path)
+            if mapped is None:
+                size = DataVersion.SLOT.size * len(DataVersion.NAMESPACES)
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                    created = os.fstat(fd).st_size == 0
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                    mapped = (fd, mmap.mmap(fd, size))
+                    if created:
+                        DataVersion.SLOT.pack_into(mapped[1], 0, int.from_bytes(os.urandom(4), 'little'))
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                except Exception:
+                    os.close(fd)
+                    raise
+                DataVersion._maps[path] = mapped
+        return mapped
+
+    @staticmethod
+    def get(namespace):
+        _, data = DataVersion._map()
+        offset = DataVersion.NAMESPACES.index(namespace) * DataVersion.SLOT.size
+        return DataVersion.SLOT.unpack_from(data, offset)[0]
+
+    @staticmethod
+    def get_with_local(*namespaces):
+        """(version, bumps made by this process) of each namespace, read atomically with local bumps"""
+        DataVersion._map()
+        with DataVersion._lock:
+            return {namespace: (DataVersion.get(namespace), DataVersion._local.get(namespace, 0))
+                    for namespace in namespaces}
+
+    @staticmethod
+    def bump(*namespaces):
+        fd, data = DataVersion._map()
+        with DataVersion._lock:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                for namespace in namespaces:
+                    offset = DataVersion.NAMESPACES.index(namespace) * DataVersion.SLOT.size
+                    DataVersion.SLOT.pack_into(data, offset, DataVersion.SLOT.unpack_from(data, offset)[0] + 1)
+                    DataVersion._local[namespace] = DataVersion._local.get(namespace, 0) + 1
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
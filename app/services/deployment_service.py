@@ -1,13 +1,19 @@
 import os
+import json
 import yaml
 import subprocess
 import threading
 from datetime import datetime
 from flask import current_app
 from config import Config
-from database import DatabaseManager
+from database import DatabaseManager, release_db
 from services.event_service import EventService
-from app import create_app
+from services.fact_cache_service import FactCacheService
+from services.inventory_service import InventoryService
+from services.metrics_service import ANSIBLE_PROCESSES
+from services.playbook_service import PlaybookService
+from services.revision_service import RevisionService
+from services.scheduler_service import DeploymentScheduler
 
 class DeploymentService:
     @staticmethod
@@ -22,69 +28,343 @@ class DeploymentService:
             return [host['name'] for host in hosts]
 
     @staticmethod
-    def start_deployment(environment, playbook, target_hosts):
+    def start_deployment(environment, playbook, target_hosts, priority=0, incremental=False):
+        """Queue a deployment, or join an identical one, and describe the job it ended up in
+
+        In incremental mode hosts that already converged on the current revision
+        of the playbook with their current vars are left out; None when none is left.
+        """
         playbook_path = Config.get_playbook_path(playbook)
         if not os.path.isfile(playbook_path):
             raise ValueError(f"Le playbook {playbook} n'existe pas")
 
+        # Cached by content hash; a playbook edited outside the application and not
+        # syntax-checked yet is queued anyway, the worker checks it before running it
+        error = PlaybookService.check_playbook(playbook, syntax=False)
+        if error:
+            raise ValueError(f"Le playbook {playbook} est invalide: {error}")
+
         if not target_hosts:
             raise ValueError('Aucun hôte à déployer')
 
-        DatabaseManager.update_hosts_status(target_hosts, 'deploying')
-        EventService.notify_deployment_start(environment, playbook, target_hosts)
+        requested = len(target_hosts)
+        # Only runs applying the same content can absorb this request
+        revision, vars_hashes = DeploymentService.host_revisions(environment, playbook, target_hosts)
+        if incremental:
+            target_hosts = DeploymentService.outdated_hosts(environment, playbook, target_hosts, revision, vars_hashes)
+            if not target_hosts:
+                return None
+
+        job_id, coalesced, added, covered = DeploymentScheduler.enqueue(
+            environment, playbook, target_hosts, priority, revision, vars_hashes
+        )
+        job = DatabaseManager.get_deployment(job_id)
+        return {
+            'job_id': job_id,
+            'job_status': job['status'],
+            'position': DatabaseManager.get_queue_position(job_id) if job['status'] == 'queued' else None,
+            'coalesced': coalesced,
+            'added': len(added),
+            'covered': len(covered),
+            'skipped': requested - len(target_hosts)
+        }
+
+    @staticmethod
+    def run_job(job):
+        """Run a deployment claimed by a scheduler worker, return the ansible exit code"""
+        return DeploymentService._run_ansible_deployment(
+            job['environment'], job['playbook'], json.loads(job['hosts']), job['id']
+        )
+
+    @staticmethod
+    def get_deployment(deployment_id):
+        job = DatabaseManager.get_deployment(deployment_id)
+        if job is None:
+            return None
+        deployment = dict(job)
+        deployment['hosts'] = [dict(h) for h in DatabaseManager.get_deployment_hosts(deployment_id)]
+        if deployment['status'] == 'queued':
+            deployment['position'] = DatabaseManager.get_queue_position(deployment_id)
+        return deployment
+
+    @staticmethod
+    def list_deployments(args):
+        """Return (deployments, total, next cursor) for the query arguments of /deployments"""
+        filters = {key: args.get(key) for key in ('environment', 'status') if args.get(key)}
+        limit = args.get('limit')
+        if limit in (None, ''):
+            limit = Config.DEPLOYMENTS_PAGE_SIZE
+        elif not limit.isdigit() or not 1 <= int(limit) <= Config.DEPLOYMENTS_MAX_PAGE_SIZE:
+            raise ValueError(f"La limite doit être comprise entre 1 et {Config.DEPLOYMENTS_MAX_PAGE_SIZE}")
+        limit = int(limit)
+        cursor = args.get('cursor')
+        if cursor and not cursor.isdigit():
+            raise ValueError("Curseur invalide")
 
-        threading.Thread(
-            target=DeploymentService._run_ansible_deployment,
-            args=(environment, playbook, target_hosts)
-        ).start()
+        rows = DatabaseManager.list_deployments(filters, int(cursor) if cursor else None, limit + 1)
+        next_cursor = str(rows[limit - 1]['id']) if len(rows) > limit else None
+        deployments = []
+        for row in rows[:limit]:
+            deployment = dict(row)
+            deployment['hosts'] = json.loads(deployment['hosts'])
+            deployments.append(deployment)
+        return deployments, DatabaseManager.count_deployments(filters), next_cursor
 
     @staticmethod
-    def _run_ansible_deployment(environment, playbook, target_hosts):
+    def host_revisions(environment, playbook, target_hosts):
+        """Current playbook revision and vars hash of each target host"""
+        revision = RevisionService.playbook_revision(playbook)
+        inventories = InventoryService.host_inventories(environment, target_hosts)
+        return revision, {name: RevisionService.vars_digest(inventories[name]) for name in target_hosts}
+
+    @staticmethod
+    def outdated_hosts(environment, playbook, target_hosts, revision=None, vars_hashes=None):
+        """Target hosts whose last successful run used another revision or other vars"""
+        if revision is None:
+            revision, vars_hashes = DeploymentService.host_revisions(environment, playbook, target_hosts)
+        applied = DatabaseManager.get_host_revisions(environment, playbook, target_hosts)
+        return [name for name in target_hosts if applied.get(name) != (revision, vars_hashes[name])]
+
+    @staticmethod
+    def describe_queued(job, added, covered, action):
+        """User message for a queued, or coalesced, deployment
+
+        added hosts were put in the job by this request, covered ones were
+        already deployed by a job with the same content.
+        """
+        state = 'en cours' if job['job_status'] == 'running' else "en file d'attente"
+        if not added:
+            return f"{action}: les {covered} hôte(s) sont déjà pris en charge par le déploiement {job['job_id']} {state}"
+        if job['coalesced']:
+            message = f"{action} sur {added} hôte(s) fusionné avec le déploiement {job['job_id']} {state}"
+        elif job['position'] is None:
+            message = f"{action} sur {added} hôte(s) démarré"
+        else:
+            message = f"{action} sur {added} hôte(s) mis en file d'attente (position {job['position'] + 1})"
+        if covered:
+            message += f", {covered} hôte(s) déjà pris en charge"
+        return message
+
+    @staticmethod
+    def retry_deployment(deployment_id, priority=0):
+        """Queue the hosts a deployment failed on again, return the job and the hosts"""
+        job = DatabaseManager.get_deployment(deployment_id)
+        hosts = DatabaseManager.get_failed_deployment_hosts(deployment_id)
+        if not hosts:
+            raise ValueError('Aucun hôte en échec à relancer')
+        return DeploymentService.start_deployment(job['environment'], job['playbook'], hosts, priority), hosts
+
+    @staticmethod
+    def _ansible_env(environment, limit_file, results_file):
+        env = dict(os.environ)
+        env.update(FactCacheService.ansible_env())
+        env.update(InventoryService.ansible_env(environment, limit_file))
+        env['ANSIBLE_CALLBACK_PLUGINS'] = Config.CALLBACK_PLUGINS_DIR
+        env['ANSIBLE_CALLBACKS_ENABLED'] = Config.ANSIBLE_CALLBACKS_ENABLED
+        env['LINSEC_RESULTS_FILE'] = results_file
+        return env
+
+    @staticmethod
+    def _host_results(results_file, target_hosts, exit_code):
+        """Per-host results written by the linsec_results callback, read line by line
+
+        Without a results file, e.g. when ansible-playbook failed before the
+        callback loaded, hosts fall back to the exit code of the run. Hosts
+        missing from a recap were never touched and are reported as skipped.
+        """
+        targets = set(target_hosts)
+        results = {}
+        fallback = 'ok' if exit_code == 0 else 'failed'
         try:
+            with open(results_file) as f:
+                for line in f:
+                    try:
+                        recap = json.loads(line)
+                    except ValueError:
+                        continue
+                    host = recap.pop('host', None)
+                    if host not in targets:
+                        continue
+                    if recap.get('unreachable'):
+                        recap['status'] = 'unreachable'
+                    elif recap.get('failures'):
+                        recap['status'] = 'failed'
+                    elif recap.get('changed'):
+                        recap['status'] = 'changed'
+                    else:
+                        recap['status'] = 'ok'
+                    results[host] = recap
+            # No play matched them, or a limit left them out
+            fallback = 'skipped'
+        except FileNotFoundError:
+            pass
+
+        for host in target_hosts:
+            results.setdefault(host, {'status': fallback})
+        return results
+
+    @staticmethod
+    def _shard(target_hosts, deployment_id=None):
+        """Split large deployments in balanced shards, as many as the global process budget allows
+
+        Shards are taken from the same DEPLOYMENT_MAX_CONCURRENT budget the
+        scheduler claims jobs against, so concurrent jobs never run more
+        ansible-playbook processes than it, whatever their size.
+        """
+        count = -(-len(target_hosts) // Config.DEPLOYMENT_SHARD_MIN_HOSTS)
+        count = max(1, min(count, Config.DEPLOYMENT_MAX_SHARDS))
+        if count > 1 and deployment_id is not None:
+            count = DatabaseManager.reserve_deployment_processes(
+                deployment_id, count, Config.DEPLOYMENT_MAX_CONCURRENT
+            )
+        return [target_hosts[index::count] for index in range(count)]
+
+    @staticmethod
+    def _copy_output(pipe, prefix, log, lock):
+        for line in pipe:
+            with lock:
+                log.write(prefix + line)
+                log.flush()
+        pipe.close()
+
+    @staticmethod
+    def _run_shards(runs, log):
+        """Run one ansible-playbook per shard in parallel and return their exit codes
+
+        Output of several shards is merged line by line into the deployment log,
+        each line prefixed with its shard.
+        """
+        if len(runs) == 1:
+            cmd, env, *_ = runs[0]
+            process = subprocess.Popen(
+                cmd,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                cwd=Config.ANSIBLE_DIR,
+                env=env,
+                text=True
+            )
+            return [process.wait()]
+
+        lock = threading.Lock()
+        processes, readers = [], []
+        try:
+            for index, (cmd, env, *_) in enumerate(runs):
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=Config.ANSIBLE_DIR,
+                    env=env,
+                    text=True,
+                    errors='replace'
+                )
+                processes.append(process)
+                reader = threading.Thread(
+                    target=DeploymentService._copy_output,
+                    args=(process.stdout, f"[{index + 1}/{len(runs)}] ", log, lock),
+                    daemon=True
+                )
+                reader.start()
+                readers.append(reader)
+        except Exception:
+            for process in processes:
+                process.kill()
+            raise
+        finally:
+            exit_codes = [process.wait() for process in processes]
+            for reader in readers:
+                reader.join()
+        return exit_codes
+
+    @staticmethod
+    def _run_ansible_deployment(environment, playbook, target_hosts, deployment_id=None):
+        exit_code = None
+        try:
+            DatabaseManager.update_hosts_status(target_hosts, 'deploying')
+            EventService.notify_deployment_start(environment, playbook, target_hosts)
+
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            if deployment_id is not None:
+                # Several jobs can start within the same second
+                timestamp = f"{timestamp}-{deployment_id}"
             log_file = os.path.join(Config.LOG_DIR, f"deploy-{environment}-{playbook}-{timestamp}.log")
             env_file = os.path.join(Config.LOG_DIR, f"env-{timestamp}.yml")
-            hosts_file = os.path.join(Config.LOG_DIR, f"hosts-{timestamp}.yml")
+            if deployment_id is not None:
+                DatabaseManager.set_deployment_log(deployment_id, log_file)
 
             with open(env_file, 'w') as f:
                 yaml.safe_dump({'linsec_env': environment}, f)
-            with open(hosts_file, 'w') as f:
-                yaml.safe_dump({'target_hosts': target_hosts}, f)
 
-            cmd = [
-                "ansible-playbook",
-                "-i", Config.get_inventory_path(environment),
-                Config.get_playbook_path(playbook),
-                "--extra-vars", f"@{env_file}",
-                "--extra-vars", f"@{hosts_file}"
-            ]
+            # What the hosts are about to get, recorded once they converge
+            revision, vars_hashes = DeploymentService.host_revisions(environment, playbook, target_hosts)
+            if deployment_id is not None:
+                DatabaseManager.set_deployment_revision(deployment_id, revision, vars_hashes)
+
+            shards = DeploymentService._shard(target_hosts, deployment_id)
+            runs = []
+            for index, hosts in enumerate(shards):
+                suffix = f"{timestamp}-{index}" if len(shards) > 1 else timestamp
+                hosts_file = os.path.join(Config.LOG_DIR, f"hosts-{suffix}.yml")
+                limit_file = os.path.join(Config.LOG_DIR, f"limit-{suffix}")
+                results_file = os.path.join(Config.LOG_DIR, f"results-{suffix}.jsonl")
+                with open(hosts_file, 'w') as f:
+                    yaml.safe_dump({'target_hosts': hosts}, f)
+                with open(limit_file, 'w') as f:
+                    f.write(''.join(f"{host}\n" for host in hosts))
+                # The dynamic inventory only lists the hosts of the limit file
+                env = DeploymentService._ansible_env(environment, limit_file, results_file)
+                cmd = [
+                    "ansible-playbook",
+                    "-i", Config.INVENTORY_SCRIPT,
+                    "--limit", f"@{limit_file}",
+                    Config.get_playbook_path(playbook),
+                    "--extra-vars", f"@{env_file}",
+                    "--extra-vars", f"@{hosts_file}"
+                ]
+                runs.append((cmd, env, hosts, hosts_file, limit_file, results_file))
 
             with open(log_file, 'w') as log:
                 log.write(f"Démarrage du déploiement à {datetime.now()}\n")
-                log.write(f"Commande: {' '.join(cmd)}\n\n")
+                if len(runs) > 1:
+                    log.write(f"{len(target_hosts)} hôtes répartis sur {len(runs)} processus ansible-playbook\n")
+                for cmd, *_ in runs:
+                    log.write(f"Commande: {' '.join(cmd)}\n")
+                log.write("\n")
                 log.flush()
 
                 try:
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=log,
-                        stderr=subprocess.STDOUT,
-                        cwd=Config.ANSIBLE_DIR,
-                        text=True
-                    )
-                    process.wait()
+                    # Completes the check of playbooks edited outside the application
+                    error = PlaybookService.check_playbook(playbook)
+                    if error:
+                        raise ValueError(f"Le playbook {playbook} est invalide: {error}")
+
+                    # Do not hold a pooled connection while ansible runs
+                    release_db()
+
+                    ANSIBLE_PROCESSES.inc(amount=len(runs))
+                    try:
+                        exit_codes = DeploymentService._run_shards(runs, log)
+                    finally:
+                        ANSIBLE_PROCESSES.dec(amount=len(runs))
+                    # Any failing shard fails the deployment, keep the most severe ansible code
+                    exit_code = max(exit_codes)
 
                     log.write(f"\n\nDéploiement terminé à {datetime.now()}")
-                    log.write(f"\nCode de sortie: {process.returncode}")
+                    log.write(f"\nCode de sortie: {exit_code}")
 
-                    if process.returncode == 0:
-                        DatabaseManager.update_hosts_status(target_hosts, 'secured')
-                        success = True
-                    else:
-                        DatabaseManager.update_hosts_status(target_hosts, 'error')
-                        success = False
+                    results = {}
+                    for (_, _, hosts, *_, results_file), shard_exit_code in zip(runs, exit_codes):
+                        results.update(DeploymentService._host_results(results_file, hosts, shard_exit_code))
+                    DatabaseManager.record_deployment_results(deployment_id, results)
+                    converged = {name: vars_hashes[name] for name, result in results.items()
+                                 if result['status'] in ('ok', 'changed')}
+                    DatabaseManager.record_host_revisions(
+                        environment, playbook, revision, converged,
+                        [name for name in results if name not in converged], deployment_id
+                    )
 
-                    EventService.notify_deployment_complete(environment, playbook, target_hosts, success)
+                    EventService.notify_deployment_complete(environment, playbook, target_hosts, exit_code == 0)
 
                 except Exception as e:
                     log.write(f"\n\nERREUR: {str(e)}")
@@ -92,7 +372,7 @@ class DeploymentService:
                     EventService.notify_deployment_complete(environment, playbook, target_hosts, False)
                     raise
                 finally:
-                    for f in [env_file, hosts_file]:
+                    for f in [env_file] + [path for run in runs for path in run[3:]]:
                         try:
                             os.remove(f)
                         except:
@@ -102,3 +382,6 @@ class DeploymentService:
 
         except Exception as e:
             current_app.logger.error(f"Erreur de déploiement: {str(e)}")
+            if exit_code is None:
+                DatabaseManager.update_hosts_status(target_hosts, 'error')
+        return exit_code
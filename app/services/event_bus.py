@@ -0,0 +1,45 @@
+import uuid
+import threading
+from collections import deque, namedtuple
+from config import Config
+
+Event = namedtuple('Event', ['version', 'topic', 'data'])
+
+
+class EventBus:
+    """In-process publish/subscribe bus
+
+    Publishers bump a version and append the event to a bounded ring
+    buffer; subscribers block until the version moves past the one they
+    have seen. The epoch tells versions of different processes apart.
+    """
+    EPOCH = uuid.uuid4().hex[:8]
+
+    _condition = threading.Condition()
+    _version = 0
+    _events = deque(maxlen=Config.SSE_EVENT_BUFFER_SIZE)
+
+    @staticmethod
+    def publish(topic, data=None):
+        with EventBus._condition:
+            EventBus._version += 1
+            EventBus._events.append(Event(EventBus._version, topic, data))
+            EventBus._condition.notify_all()
+            return EventBus._version
+
+    @staticmethod
+    def version():
+        return EventBus._version
+
+    @staticmethod
+    def wait(since, timeout=None):
+        """Wait for events newer than since
+
+        Returns (version, events, complete); complete is False when older
+        events have already left the buffer.
+        """
+        with EventBus._condition:
+            EventBus._condition.wait_for(lambda: EventBus._version > since, timeout)
+            events = [e for e in EventBus._events if e.version > since]
+            complete = not EventBus._events or EventBus._events[0].version <= since + 1
+            return EventBus._version, events, complete
@@ -1,31 +1,214 @@
-import time
 import json
-from database import DatabaseManager
+import time
+import logging
+import threading
+from collections import OrderedDict
+from config import Config
+from database import DatabaseManager, release_db
+from services.data_version import DataVersion
+from services.event_bus import EventBus
+from services.metrics_service import SSE_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
 
 class EventService:
-    EVENT_LISTENERS = []
+    # Serialized payloads shared by every subscriber
+    _snapshots = {}
+    _event_bodies = OrderedDict()
+    _lock = threading.Lock()
+    _build_locks = {'stats': threading.Lock(), 'hosts': threading.Lock()}
+    _watcher = None
+
+    @staticmethod
+    def _body(data):
+        return f"data: {json.dumps(data)}\n\n"
 
     @staticmethod
-    def get_event_stream():
+    def _event_id(version):
+        return f"{EventBus.EPOCH}-{version}"
+
+    @staticmethod
+    def _parse_event_id(last_event_id):
+        """Version of a Last-Event-ID sent by this process, None otherwise"""
+        epoch, _, version = (last_event_id or '').partition('-')
+        if epoch != EventBus.EPOCH or not version.isdigit():
+            return None
+        version = int(version)
+        return version if version <= EventBus.version() else None
+
+    @staticmethod
+    def _snapshot_body(topic, version):
+        """Build the full payload of a topic once per version
+
+        The query runs outside the shared lock, so event payload lookups and
+        other topics never wait for a large hosts table; concurrent
+        subscribers of the same topic wait for one build instead of each
+        running it.
+        """
+        with EventService._lock:
+            cached = EventService._snapshots.get(topic)
+        if cached and cached[0] >= version:
+            return cached[1]
+
+        with EventService._build_locks[topic]:
+            with EventService._lock:
+                cached = EventService._snapshots.get(topic)
+            if cached and cached[0] >= version:
+                return cached[1]
+
+            # Changes are published after they commit, the query sees every one up to here
+            built_version = max(version, EventBus.version())
+            try:
+                if topic == 'stats':
+                    body = EventService._body({'type': 'stats', 'data': DatabaseManager.get_current_stats()})
+                else:
+                    hosts = DatabaseManager.get_all_hosts()
+                    body = EventService._body({'type': 'hosts', 'data': [dict(h) for h in hosts]})
+            finally:
+                # Streams are long-lived, do not hold a pooled connection between changes
+                release_db()
+
+            with EventService._lock:
+                cached = EventService._snapshots.get(topic)
+                if not cached or cached[0] < built_version:
+                    EventService._snapshots[topic] = (built_version, body)
+            return body
+
+    @staticmethod
+    def _hosts_delta_body(change):
+        deleted = list(change.get('deleted', []))
+        ids = change.get('ids', [])
+        names = change.get('names', [])
+        if len(ids) + len(names) > Config.SSE_DELTA_MAX_HOSTS:
+            return None
+
+        try:
+            hosts = [dict(h) for h in DatabaseManager.get_hosts_by_ids(ids)]
+            hosts += [dict(h) for h in DatabaseManager.get_hosts_by_names(names)]
+        finally:
+            release_db()
+        # Hosts removed since the change was published are reported as deleted
+        found = {h['id'] for h in hosts}
+        deleted += [host_id for host_id in ids if host_id not in found]
+        return EventService._body({'type': 'hosts_delta', 'data': {'hosts': hosts, 'deleted': deleted}})
+
+    @staticmethod
+    def _event_body(event):
+        """Payload of one bus event, built once and kept as long as the event is buffered"""
+        if event.topic == 'deployment':
+            return event.data
+        if event.topic != 'hosts':
+            return None
+
+        with EventService._lock:
+            if event.version in EventService._event_bodies:
+                return EventService._event_bodies[event.version]
+
+        change = event.data or {}
+        # Changes made by other processes only come with a full snapshot
+        body = None if change.get('snapshot') else EventService._hosts_delta_body(change)
+        if body is None:
+            body = EventService._snapshot_body('hosts', event.version)
+
+        with EventService._lock:
+            EventService._event_bodies[event.version] = body
+            while len(EventService._event_bodies) > Config.SSE_EVENT_BUFFER_SIZE:
+                EventService._event_bodies.popitem(last=False)
+        return body
+
+    @staticmethod
+    def _event_frames(events, version):
+        stats_changed = False
+        for event in events:
+            body = EventService._event_body(event)
+            if body:
+                yield f"id: {EventService._event_id(event.version)}\n{body}"
+            if event.topic in ('hosts', 'stats'):
+                stats_changed = True
+        if stats_changed:
+            # Stats are small, send them once whatever the number of changes
+            yield f"id: {EventService._event_id(version)}\n{EventService._snapshot_body('stats', version)}"
+
+    @staticmethod
+    def _snapshot_frames(version):
+        event_id = EventService._event_id(version)
+        yield f"id: {event_id}\n{EventService._snapshot_body('stats', version)}"
+        yield f"id: {event_id}\n{EventService._snapshot_body('hosts', version)}"
+
+    @staticmethod
+    def get_event_stream(last_event_id=None):
+        SSE_SUBSCRIBERS.inc('events')
+        try:
+            yield from EventService._event_stream(last_event_id)
+        finally:
+            SSE_SUBSCRIBERS.dec('events')
+
+    @staticmethod
+    def _event_stream(last_event_id):
+        yield f"retry: {Config.SSE_RETRY_MS}\n\n"
+
+        # Replay what a reconnecting client missed, or start from a snapshot
+        version = EventService._parse_event_id(last_event_id)
+        if version is not None:
+            version, events, complete = EventBus.wait(version, 0)
+            if complete:
+                yield from EventService._event_frames(events, version)
+            else:
+                yield from EventService._snapshot_frames(version)
+        else:
+            version = EventBus.version()
+            yield from EventService._snapshot_frames(version)
+
         while True:
-            if EventService.EVENT_LISTENERS:
-                time.sleep(1)
-                stats = DatabaseManager.get_latest_stats()
-                hosts = DatabaseManager.get_all_hosts()
+            new_version, events, complete = EventBus.wait(version, Config.SSE_KEEPALIVE_INTERVAL)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
 
-                yield f"data: {json.dumps({'type': 'stats', 'data': dict(stats) if stats else {}})}\n\n"
-                yield f"data: {json.dumps({'type': 'hosts', 'data': [dict(h) for h in hosts]})}\n\n"
+            if complete:
+                yield from EventService._event_frames(events, new_version)
             else:
-                time.sleep(5)
+                yield from EventService._snapshot_frames(new_version)
+            version = new_version
+
+    @staticmethod
+    def start_watcher(app):
+        """Publish on this process' bus the changes other processes made
+
+        Every write bumps the shared DataVersion counters; when one moved by
+        more than the bumps made here, another worker or a CLI command
+        changed the data and subscribers get a fresh snapshot.
+        """
+        if EventService._watcher is not None:
+            return
+
+        def run():
+            seen = None
+            while True:
+                time.sleep(Config.SSE_REMOTE_POLL_INTERVAL)
+                try:
+                    with app.app_context():
+                        current = DataVersion.get_with_local('hosts', 'stats')
+                    if seen is not None:
+                        for namespace, (shared, local) in current.items():
+                            if shared - seen[namespace][0] > local - seen[namespace][1]:
+                                EventBus.publish(namespace, {'snapshot': True} if namespace == 'hosts' else None)
+                    seen = current
+                except Exception as e:
+                    logger.error(f"Erreur lors du suivi des modifications: {str(e)}")
+
+        thread = threading.Thread(target=run, name='event-watcher', daemon=True)
+        EventService._watcher = thread
+        thread.start()
 
     @staticmethod
     def notify_deployment_start(environment, playbook, hosts):
-        EventService.EVENT_LISTENERS.append({
+        EventBus.publish('deployment', EventService._body({
             'type': 'deployment',
             'message': f"Déploiement de {playbook} sur {len(hosts)} hôte(s) démarré",
             'status': 'deploying',
             'hosts': hosts
-        })
+        }))
 
     @staticmethod
     def notify_deployment_complete(environment, playbook, hosts, success):
@@ -35,9 +218,9 @@ class EventService:
             if success else
             f"Échec du déploiement de {playbook} sur {len(hosts)} hôte(s)"
         )
-        EventService.EVENT_LISTENERS.append({
+        EventBus.publish('deployment', EventService._body({
             'type': 'deployment',
             'message': message,
             'status': status,
             'hosts': hosts
-        })
+        }))
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+from datetime import datetime
+from config import Config
+
+
+class FactCacheService:
+    """Ansible jsonfile fact cache managed by the application
+
+    ansible-playbook reads and fills the cache through the ANSIBLE_CACHE_*
+    settings below; the application drops the facts of hosts whose address
+    or groups change and serves the cached ones to the UI.
+    """
+    SUMMARY_FACTS = (
+        'ansible_distribution', 'ansible_distribution_version', 'ansible_os_family',
+        'ansible_kernel', 'ansible_architecture', 'ansible_hostname', 'ansible_fqdn',
+        'ansible_processor_vcpus', 'ansible_memtotal_mb', 'ansible_uptime_seconds'
+    )
+
+    @staticmethod
+    def ansible_env():
+        """Environment variables enabling the cache for an ansible-playbook run"""
+        os.makedirs(Config.FACT_CACHE_DIR, exist_ok=True)
+        return {
+            'ANSIBLE_GATHERING': 'smart',
+            'ANSIBLE_CACHE_PLUGIN': 'jsonfile',
+            'ANSIBLE_CACHE_PLUGIN_CONNECTION': Config.FACT_CACHE_DIR,
+            'ANSIBLE_CACHE_PLUGIN_TIMEOUT': str(Config.FACT_CACHE_TTL),
+        }
+
+    @staticmethod
+    def _path(host_name):
+        # Names are validated on input, never let one escape the cache directory
+        if not host_name or os.path.basename(host_name) != host_name or host_name.startswith('.'):
+            return None
+        return os.path.join(Config.FACT_CACHE_DIR, host_name)
+
+    @staticmethod
+    def invalidate(host_names):
+        for host_name in host_names:
+            path = FactCacheService._path(host_name)
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def get_facts(host_name):
+        """Cached facts of a host, None when missing or older than the TTL"""
+        path = FactCacheService._path(host_name)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+            if time.time() - mtime > Config.FACT_CACHE_TTL:
+                return None
+            with open(path) as f:
+                facts = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return {
+            'cached_at': datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            'expires_in': int(mtime + Config.FACT_CACHE_TTL - time.time()),
+            'summary': {key: facts.get(key) for key in FactCacheService.SUMMARY_FACTS},
+            'facts': facts
+        }
@@ -0,0 +1,84 @@
+import json
+import base64
+from config import Config
+from database import DatabaseManager, HOST_FIELDS
+
+
+class HostService:
+    """Paginated, filtered host listing"""
+
+    FILTERS = ('environment', 'group', 'status', 'security_level', 'name_prefix')
+
+    @staticmethod
+    def encode_cursor(host):
+        raw = json.dumps([host['added_date'], host['id']]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            added_date, host_id = json.loads(raw)
+            if not isinstance(added_date, str) or not isinstance(host_id, int):
+                raise ValueError
+            return added_date, host_id
+        except ValueError:
+            raise ValueError("Curseur invalide")
+
+    @staticmethod
+    def parse_fields(value):
+        if not value:
+            return None
+        fields = [f.strip() for f in value.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in HOST_FIELDS]
+        if unknown:
+            raise ValueError(f"Champ(s) inconnu(s): {', '.join(unknown)}")
+        return fields
+
+    @staticmethod
+    def parse_limit(value, paged=True):
+        if value in (None, ''):
+            # Clients that never asked for a page get every host, as before pagination
+            return Config.HOSTS_PAGE_SIZE if paged else None
+        if not value.isdigit() or not 1 <= int(value) <= Config.HOSTS_MAX_PAGE_SIZE:
+            raise ValueError(f"La limite doit être comprise entre 1 et {Config.HOSTS_MAX_PAGE_SIZE}")
+        return int(value)
+
+    @staticmethod
+    def count(filters):
+        """Serve the total from the maintained counters whenever a single one matches"""
+        active = {k: v for k, v in filters.items() if v}
+        if not active:
+            return DatabaseManager.get_counter('total')[0]
+        if len(active) == 1:
+            (key, value), = active.items()
+            if key in ('environment', 'group', 'security_level'):
+                return DatabaseManager.get_counter(key, value)[0]
+            if key == 'status' and value == 'secured':
+                return DatabaseManager.get_counter('total')[1]
+        return DatabaseManager.count_hosts(active)
+
+    @staticmethod
+    def list_hosts(args):
+        """Return (hosts, total, next cursor) for the query arguments of /hosts"""
+        filters = {key: args.get(key) for key in HostService.FILTERS if args.get(key)}
+        fields = HostService.parse_fields(args.get('fields'))
+        after = HostService.decode_cursor(args['cursor']) if args.get('cursor') else None
+        limit = HostService.parse_limit(args.get('limit'), paged=after is not None)
+
+        # The keyset columns are always read, only requested fields are returned
+        columns = None
+        if fields:
+            columns = list(dict.fromkeys(fields + ['added_date', 'id']))
+        rows = DatabaseManager.query_hosts(filters, columns, after, limit + 1 if limit else None)
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = HostService.encode_cursor(rows[-1])
+
+        if fields:
+            hosts = [{field: row[field] for field in fields} for row in rows]
+        else:
+            hosts = [dict(row) for row in rows]
+        return hosts, HostService.count(filters), next_cursor
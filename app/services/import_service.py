@@ -0,0 +1,148 @@
+import os
+import csv
+import json
+import codecs
+import click
+from flask.cli import with_appcontext
+from database import DatabaseManager
+from services.fact_cache_service import FactCacheService
+from services.validation_service import ValidationService
+
+
+class HostImportService:
+    """Bulk host import from CSV or NDJSON streams"""
+
+    FORMATS = ('csv', 'ndjson')
+    EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+    CONTENT_TYPES = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/ndjson': 'ndjson',
+        'application/jsonl': 'ndjson'
+    }
+    # Rows checked against the stored hosts with one query
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def detect_format(fmt=None, filename=None, content_type=None):
+        if fmt:
+            if fmt not in HostImportService.FORMATS:
+                raise ValueError(f"Format non supporté: {fmt}")
+            return fmt
+        if filename:
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in HostImportService.EXTENSIONS:
+                return HostImportService.EXTENSIONS[ext]
+        if content_type:
+            mimetype = content_type.split(';')[0].strip().lower()
+            if mimetype in HostImportService.CONTENT_TYPES:
+                return HostImportService.CONTENT_TYPES[mimetype]
+        raise ValueError("Format d'import inconnu (csv ou ndjson)")
+
+    @staticmethod
+    def iter_rows(stream, fmt):
+        """Yield (line number, raw row) from a binary stream without loading it in memory"""
+        lines = codecs.getreader('utf-8-sig')(stream)
+        if fmt == 'csv':
+            reader = csv.DictReader(lines)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(lines, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+
+    @staticmethod
+    def parse_row(row):
+        if not isinstance(row, dict):
+            raise ValueError("Ligne illisible")
+
+        groups = row.get('groups') or ''
+        if isinstance(groups, str):
+            groups = groups.replace(';', ',').replace('|', ',').split(',')
+        groups = [str(g).strip() for g in groups if str(g).strip()]
+
+        return {
+            'name': str(row.get('name') or row.get('hostname') or '').strip(),
+            'ip': str(row.get('ip') or '').strip(),
+            'environment': str(row.get('environment') or '').strip(),
+            'security_level': str(
+                row.get('security_level') or row.get('security-level') or 'medium'
+            ).strip(),
+            'groups': ','.join(groups),
+            'status': 'pending'
+        }
+
+    @staticmethod
+    def import_hosts(stream, fmt):
+        """Validate, insert and register all hosts of a stream in one pass
+
+        Hosts already stored in the same environment are reported as errors,
+        so a partial import can be run again to complete it.
+        """
+        errors = []
+        imported = []
+        seen = set()
+
+        def new_hosts(batch):
+            existing = DatabaseManager.get_existing_hosts(host_data['name'] for _, host_data in batch)
+            for line_no, host_data in batch:
+                if (host_data['name'], host_data['environment']) in existing:
+                    errors.append({'line': line_no, 'message': f"Hôte déjà existant: {host_data['name']}"})
+                    continue
+                imported.append(host_data)
+                yield host_data
+
+        def valid_rows():
+            batch = []
+            for line_no, row in HostImportService.iter_rows(stream, fmt):
+                try:
+                    host_data = HostImportService.parse_row(row)
+                except ValueError as e:
+                    errors.append({'line': line_no, 'message': str(e)})
+                    continue
+
+                error = ValidationService.validate_host(host_data)
+                if not error and host_data['name'] in seen:
+                    error = f"Hôte en double: {host_data['name']}"
+                if error:
+                    errors.append({'line': line_no, 'message': error})
+                    continue
+
+                seen.add(host_data['name'])
+                batch.append((line_no, host_data))
+                if len(batch) >= HostImportService.BATCH_SIZE:
+                    yield from new_hosts(batch)
+                    batch = []
+            yield from new_hosts(batch)
+
+        # executemany consumes the generator inside a single transaction
+        DatabaseManager.add_hosts(valid_rows())
+
+        if imported:
+            FactCacheService.invalidate(host['name'] for host in imported)
+            DatabaseManager.update_stats()
+
+        # Existing hosts are found a batch at a time, after later parse errors
+        errors.sort(key=lambda error: error['line'])
+        return {'imported': len(imported), 'errors': errors}
+
+
+@click.command('import-hosts')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(HostImportService.FORMATS), default=None)
+@with_appcontext
+def import_hosts_command(path, fmt):
+    """CLI Command to bulk import hosts from a CSV or NDJSON file"""
+    fmt = HostImportService.detect_format(fmt, filename=path)
+    with open(path, 'rb') as f:
+        result = HostImportService.import_hosts(f, fmt)
+
+    for error in result['errors']:
+        click.echo(f"Ligne {error['line']}: {error['message']}", err=True)
+    click.echo(f"{result['imported']} hôte(s) importé(s), {len(result['errors'])} erreur(s).")
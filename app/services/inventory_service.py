@@ -1,57 +1,56 @@
-import os
-import yaml
+import importlib.util
+import threading
 from config import Config
-from flask import current_app
+from database import DatabaseManager
 
-class InventoryService:
-    @staticmethod
-    def save_host_to_inventory(host_data):
-        env_dir = os.path.join(Config.INVENTORY_DIR, host_data['environment'])
-        os.makedirs(env_dir, exist_ok=True)
-
-        inv_path = Config.get_inventory_path(host_data['environment'])
-        inventory = {'all': {'children': {}}}
-        if os.path.exists(inv_path):
-            with open(inv_path, 'r') as f:
-                existing = yaml.safe_load(f)
-                if existing:
-                    inventory = existing
-
-        if 'children' not in inventory['all']:
-            inventory['all']['children'] = {}
-
-        groups = host_data['groups'].split(',') if host_data['groups'] else []
-        for group in groups:
-            if group not in inventory['all']['children']:
-                inventory['all']['children'][group] = {'hosts': {}}
-            if 'hosts' not in inventory['all']['children'][group]:
-                inventory['all']['children'][group]['hosts'] = {}
 
-            inventory['all']['children'][group]['hosts'][host_data['name']] = {
-                'ansible_host': host_data['ip'],
-                'linsec_security_level': host_data['security_level']
-            }
+class InventoryService:
+    """Ansible inventories built from the hosts table
 
-        with open(inv_path, 'w') as f:
-            yaml.safe_dump(inventory, f, default_flow_style=False, sort_keys=False)
+    ansible-playbook reads hosts through the taskengine/linsec_inventory.py
+    dynamic inventory, so nothing is written when hosts change. The vars and
+    groups of a host come from that script, loaded as a module, so revision
+    hashes always match what ansible gets.
+    """
+    _script = None
+    _lock = threading.Lock()
 
     @staticmethod
-    def remove_host_from_inventory(host_data):
-        inv_path = Config.get_inventory_path(host_data['environment'])
-        if not os.path.exists(inv_path):
-            return
-
-        try:
-            with open(inv_path, 'r') as f:
-                inventory = yaml.safe_load(f) or {'all': {'children': {}}}
+    def script():
+        """The dynamic inventory module, loaded once from Config.INVENTORY_SCRIPT"""
+        with InventoryService._lock:
+            if InventoryService._script is None:
+                spec = importlib.util.spec_from_file_location('linsec_inventory', Config.INVENTORY_SCRIPT)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                InventoryService._script = module
+            return InventoryService._script
 
-            host_name = host_data['name']
-            for group in inventory['all']['children'].values():
-                if 'hosts' in group and host_name in group['hosts']:
-                    del group['hosts'][host_name]
+    @staticmethod
+    def host_vars(host):
+        """Inventory vars of a host, as listed by linsec_inventory.py"""
+        return InventoryService.script().host_vars(host)
 
+    @staticmethod
+    def ansible_env(environment, limit_file):
+        """Environment variables pointing the dynamic inventory at the database and the target hosts"""
+        return {
+            'LINSEC_DATABASE': Config.get_database_path(),
+            'LINSEC_INVENTORY_ENVIRONMENT': environment,
+            'LINSEC_INVENTORY_LIMIT': limit_file,
+            'LINSEC_INVENTORY_CACHE_DIR': Config.INVENTORY_CACHE_DIR,
+            'LINSEC_INVENTORY_CACHE_TTL': str(Config.INVENTORY_CACHE_TTL),
+        }
 
-            with open(inv_path, 'w') as f:
-                yaml.safe_dump(inventory, f, default_flow_style=False, sort_keys=False)
-        except Exception as e:
-            current_app.logger.error(f"Erreur lors de la suppression de l'hôte: {str(e)}")
+    @staticmethod
+    def host_inventories(environment, host_names):
+        """Inventory of each host on its own: its vars and its groups"""
+        script = InventoryService.script()
+        inventories = {name: {'vars': {}, 'groups': []} for name in host_names}
+        for host in DatabaseManager.get_hosts_by_names(host_names):
+            if host['environment'] == environment:
+                inventories[host['name']] = {
+                    'vars': script.host_vars(host),
+                    'groups': script.host_groups(host)
+                }
+        return inventories
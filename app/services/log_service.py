@@ -0,0 +1,191 @@
+import json
+import time
+import threading
+from config import Config
+from database import DatabaseManager, release_db
+from services.metrics_service import SSE_SUBSCRIBERS
+
+
+class LogTail:
+    """Incremental reader of one deployment log shared by all its viewers
+
+    The reader thread follows the file from a byte offset and keeps the
+    most recent output in a bounded buffer; viewers further behind read
+    the missing range straight from the file.
+    """
+
+    def __init__(self, deployment_id, offset):
+        self.deployment_id = deployment_id
+        self.path = None
+        self.start = offset
+        self.end = offset
+        self.buffer = bytearray()
+        self.finished = False
+        self.status = None
+        self.exit_code = None
+        self.viewers = 0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def _complete_lines(data, final):
+        """Keep whole lines only, unless the chunk is a single oversized line or the log is complete"""
+        if final or data.endswith(b'\n'):
+            return data
+        cut = data.rfind(b'\n')
+        if cut == -1:
+            return data if len(data) >= Config.LOG_TAIL_CHUNK_SIZE else b''
+        return data[:cut + 1]
+
+    def _read_file(self, offset, size, final):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return self._complete_lines(f.read(size), final)
+        except (FileNotFoundError, TypeError):
+            return b''
+
+    def _append(self, data):
+        with self.condition:
+            self.buffer += data
+            self.end += len(data)
+            overflow = len(self.buffer) - Config.LOG_TAIL_BUFFER_SIZE
+            if overflow > 0:
+                del self.buffer[:overflow]
+                self.start += overflow
+            self.condition.notify_all()
+
+    def _finish(self, job):
+        with self.condition:
+            self.finished = True
+            if job is not None:
+                self.status = job['status']
+                self.exit_code = job['exit_code']
+            self.condition.notify_all()
+
+    def read(self, offset, timeout):
+        """Return (offset, data, finished) for the output after offset"""
+        with self.condition:
+            if offset >= self.end and not self.finished:
+                self.condition.wait(timeout)
+            start = self.start
+
+        if offset < start:
+            # Behind the shared buffer: catch up from the file
+            data = self._read_file(offset, min(start - offset, Config.LOG_TAIL_CHUNK_SIZE), True)
+            if data:
+                return offset + len(data), data, False
+            offset = start
+
+        with self.condition:
+            if offset >= self.end:
+                # Nothing new yet, or a viewer that already has output this reader has not reached
+                return offset, b'', self.finished
+            offset = max(offset, self.start)
+            index = offset - self.start
+            data = bytes(self.buffer[index:index + Config.LOG_TAIL_CHUNK_SIZE])
+            data = self._complete_lines(data, offset + len(data) == self.end)
+            return offset + len(data), data, self.finished and offset + len(data) == self.end
+
+    def follow(self, app):
+        """Reader loop, stops once the job is over and read or nobody watches anymore"""
+        with app.app_context():
+            position = self.end
+            while LogTailService.keep(self):
+                if self.path is None:
+                    job = DatabaseManager.get_deployment(self.deployment_id)
+                    release_db()
+                    if job is None or (not job['log_path'] and job['status'] not in ('queued', 'running')):
+                        self._finish(job)
+                        continue
+                    if not job['log_path']:
+                        time.sleep(Config.LOG_TAIL_POLL_INTERVAL)
+                        continue
+                    self.path = job['log_path']
+
+                data = self._read_file(position, Config.LOG_TAIL_CHUNK_SIZE, False)
+                if data:
+                    position += len(data)
+                    self._append(data)
+                    continue
+
+                if self.finished:
+                    time.sleep(Config.LOG_TAIL_POLL_INTERVAL)
+                    continue
+
+                job = DatabaseManager.get_deployment(self.deployment_id)
+                release_db()
+                if job is None or job['status'] not in ('queued', 'running'):
+                    # The runner closed the log before recording the outcome, drain what is left
+                    while True:
+                        data = self._read_file(position, Config.LOG_TAIL_CHUNK_SIZE, True)
+                        if not data:
+                            break
+                        position += len(data)
+                        self._append(data)
+                    self._finish(job)
+                    continue
+                time.sleep(Config.LOG_TAIL_POLL_INTERVAL)
+
+
+class LogTailService:
+    _tails = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def subscribe(app, deployment_id, offset):
+        with LogTailService._lock:
+            tail = LogTailService._tails.get(deployment_id)
+            if tail is None:
+                tail = LogTail(deployment_id, offset)
+                LogTailService._tails[deployment_id] = tail
+                threading.Thread(
+                    target=tail.follow, args=(app,),
+                    name=f'deployment-log-{deployment_id}', daemon=True
+                ).start()
+            tail.viewers += 1
+            return tail
+
+    @staticmethod
+    def unsubscribe(tail):
+        with LogTailService._lock:
+            tail.viewers -= 1
+
+    @staticmethod
+    def keep(tail):
+        """Whether the reader of a tail should go on, unregister it otherwise"""
+        with LogTailService._lock:
+            if tail.viewers > 0:
+                return True
+            if LogTailService._tails.get(tail.deployment_id) is tail:
+                del LogTailService._tails[tail.deployment_id]
+            return False
+
+    @staticmethod
+    def _frame(offset, data):
+        lines = data.decode('utf-8', errors='replace').splitlines() or ['']
+        return f"id: {offset}\n" + ''.join(f"data: {line}\n" for line in lines) + "\n"
+
+    @staticmethod
+    def get_log_stream(app, deployment_id, offset=0):
+        """SSE stream of a deployment log from a byte offset, event ids are offsets"""
+        # Streams are long-lived, do not hold a pooled connection
+        release_db()
+        yield f"retry: {Config.SSE_RETRY_MS}\n\n"
+
+        tail = LogTailService.subscribe(app, deployment_id, offset)
+        SSE_SUBSCRIBERS.inc('deployment_log')
+        try:
+            while True:
+                offset, data, finished = tail.read(offset, Config.SSE_KEEPALIVE_INTERVAL)
+                if data:
+                    yield LogTailService._frame(offset, data)
+                elif finished:
+                    yield f"id: {offset}\nevent: end\ndata: " + json.dumps({
+                        'status': tail.status, 'exit_code': tail.exit_code
+                    }) + "\n\n"
+                    return
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            SSE_SUBSCRIBERS.dec('deployment_log')
+            LogTailService.unsubscribe(tail)
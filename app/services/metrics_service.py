@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import fcntl
+import bisect
+import logging
+import tempfile
+import threading
+from functools import wraps
+from flask import g, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached SQLite read to an ansible-playbook run
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600
+)
+
+
+class Metric:
+    """Values of one metric by label values, updated under a per-metric lock
+
+    Recording is a dict lookup and an addition; the text format is only
+    built when /metrics is scraped.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        MetricsRegistry.register(self)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """Per-process gauge, summed over the live worker processes"""
+    TYPE = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def observe(self, value, *label_values):
+        # Per-bucket counts followed by the sum, cumulated when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), list(value)] for key, value in self.values.items()]
+
+
+class MetricsRegistry:
+    """Metrics of every worker process, in the Prometheus text format
+
+    Each process writes its values to a file named after its pid in the
+    instance folder; a scrape adds up the files. Counters and histograms
+    of exited processes are folded into an archive file so totals never go
+    down, their gauges are dropped.
+    """
+    _metrics = {}
+    _collectors = {}
+    _lock = threading.Lock()
+    _flusher = None
+
+    @staticmethod
+    def register(metric):
+        with MetricsRegistry._lock:
+            MetricsRegistry._metrics[metric.name] = metric
+
+    @staticmethod
+    def register_collector(name, collector):
+        """Add a function returning (name, type, help, [(labels dict, value)]) computed at scrape time
+
+        Registering a name again replaces its collector, so every application
+        created in a process reports the metric once.
+        """
+        with MetricsRegistry._lock:
+            MetricsRegistry._collectors[name] = collector
+
+    @staticmethod
+    def snapshot():
+        with MetricsRegistry._lock:
+            metrics = list(MetricsRegistry._metrics.values())
+        return {
+            metric.name: {
+                'type': metric.TYPE,
+                'help': metric.documentation,
+                'labels': list(metric.labels),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'values': metric.snapshot()
+            }
+            for metric in metrics
+        }
+
+    @staticmethod
+    def _path(directory, pid):
+        return os.path.join(directory, f"{pid}.json")
+
+    @staticmethod
+    def _write(path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.metrics.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def flush(directory):
+        os.makedirs(directory, exist_ok=True)
+        MetricsRegistry._write(MetricsRegistry._path(directory, os.getpid()), MetricsRegistry.snapshot())
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _merge(total, snapshot, gauges=True):
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not gauges:
+                continue
+            merged = total.setdefault(name, dict(metric, values=[]))
+            values = {tuple(key): value for key, value in merged['values']}
+            for key, value in metric['values']:
+                key = tuple(key)
+                if key not in values:
+                    values[key] = value
+                elif isinstance(value, list):
+                    values[key] = [a + b for a, b in zip(values[key], value)]
+                else:
+                    values[key] += value
+            merged['values'] = [[list(key), value] for key, value in values.items()]
+        return total
+
+    @staticmethod
+    def _archive_dead(directory):
+        """Fold the files of exited processes into the archive"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(directory, 'archive.json')
+            archive = MetricsRegistry._read(archive_path) or {}
+            dead = []
+            for item in os.scandir(directory):
+                pid = item.name[:-len('.json')]
+                if item.name.endswith('.json') and pid.isdigit() and not MetricsRegistry._alive(int(pid)):
+                    MetricsRegistry._merge(archive, MetricsRegistry._read(item.path) or {}, gauges=False)
+                    dead.append(item.path)
+            if dead:
+                MetricsRegistry._write(archive_path, archive)
+                for path in dead:
+                    os.remove(path)
+
+    @staticmethod
+    def collect(directory):
+        """Metrics of all the processes added up"""
+        MetricsRegistry.flush(directory)
+        total = {}
+        for item in os.scandir(directory):
+            if not item.name.endswith('.json'):
+                continue
+            pid = item.name[:-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not MetricsRegistry._alive(int(pid)):
+                # Exited since the last archive, its counters are folded in at the next start
+                MetricsRegistry._merge(total, MetricsRegistry._read(item.path) or {}, gauges=False)
+            else:
+                MetricsRegistry._merge(total, MetricsRegistry._read(item.path) or {})
+        return total
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def _labels(names, values, extra=''):
+        pairs = [f'{name}="{MetricsRegistry._escape(value)}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @staticmethod
+    def _number(value):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    @staticmethod
+    def render(directory):
+        lines = []
+        metrics = MetricsRegistry.collect(directory)
+        for name in sorted(metrics):
+            metric = metrics[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metrics[name]['values']):
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{MetricsRegistry._labels(metric['labels'], key)} {MetricsRegistry._number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + [float('inf')], value[:-1]):
+                    cumulative += count
+                    le = 'le="' + MetricsRegistry._number(float(bound)) + '"'
+                    lines.append(f"{name}_bucket{MetricsRegistry._labels(metric['labels'], key, le)} {cumulative}")
+                labels = MetricsRegistry._labels(metric['labels'], key)
+                lines.append(f"{name}_sum{labels} {MetricsRegistry._number(value[-1])}")
+                lines.append(f"{name}_count{labels} {cumulative}")
+
+        with MetricsRegistry._lock:
+            collectors = list(MetricsRegistry._collectors.values())
+        for collector in collectors:
+            try:
+                name, metric_type, documentation, samples = collector()
+            except Exception as e:
+                logger.error(f"Erreur lors de la collecte des métriques: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{MetricsRegistry._labels(labels.keys(), labels.values())} {MetricsRegistry._number(value)}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def init_app(app):
+        """Count and time every request, and share this process' values with the others"""
+        @app.before_request
+        def start_request_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                # The URL rule, not the path, keeps label values bounded
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+                HTTP_DURATION.observe(time.perf_counter() - started, route, request.method)
+            return response
+
+        MetricsRegistry.start_flusher(app)
+
+    @staticmethod
+    def start_flusher(app):
+        """Write this process' values in the background, after archiving exited workers"""
+        if MetricsRegistry._flusher is not None:
+            return
+
+        def run():
+            archived = False
+            while True:
+                time.sleep(Config.METRICS_FLUSH_INTERVAL)
+                try:
+                    with app.app_context():
+                        directory = Config.get_metrics_path()
+                    if not archived:
+                        MetricsRegistry._archive_dead(directory)
+                        archived = True
+                    MetricsRegistry.flush(directory)
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'écriture des métriques: {str(e)}")
+
+        thread = threading.Thread(target=run, name='metrics-flush', daemon=True)
+        MetricsRegistry._flusher = thread
+        thread.start()
+
+
+def timed_methods(cls, histogram):
+    """Time every public static method of a class into a histogram labelled by method"""
+    for name, member in list(vars(cls).items()):
+        if name.startswith('_') or not isinstance(member, staticmethod):
+            continue
+
+        def wrap(fn, name):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, name)
+            return wrapper
+        setattr(cls, name, staticmethod(wrap(member.__func__, name)))
+
+
+HTTP_REQUESTS = Counter(
+    'linsec_http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status')
+)
+HTTP_DURATION = Histogram(
+    'linsec_http_request_duration_seconds', 'Time to build HTTP responses, streams excluded', ('route', 'method')
+)
+DB_DURATION = Histogram('linsec_db_method_duration_seconds', 'DatabaseManager call durations', ('method',))
+SSE_SUBSCRIBERS = Gauge('linsec_sse_subscribers', 'Open server-sent event streams', ('stream',))
+ANSIBLE_PROCESSES = Gauge('linsec_ansible_playbook_processes', 'Running ansible-playbook processes')
+DEPLOYMENTS = Counter(
+    'linsec_deployments_total', 'Finished deployments by outcome', ('environment', 'playbook', 'status')
+)
+DEPLOYMENT_DURATION = Histogram(
+    'linsec_deployment_duration_seconds', 'Deployment run durations', ('environment', 'playbook', 'status')
+)
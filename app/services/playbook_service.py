@@ -1,15 +1,228 @@
 import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+import yaml
 from config import Config
+from database import DatabaseManager, release_db
+from services.data_version import DataVersion
+from services.revision_service import RevisionService
 from services.validation_service import ValidationService
+from services.yaml_loader import YamlLoader
+
+logger = logging.getLogger(__name__)
+
+
+class PlaybookCatalog:
+    """In-memory index of the playbooks directory with parsed metadata
+
+    Kept fresh by polling file mtimes from a background thread; files are
+    parsed again only when their mtime or size changes, and any change
+    bumps the playbooks data version.
+    """
+    _entries = {}
+    _keys = {}
+    _lock = threading.Lock()
+    _watcher = None
+
+    @staticmethod
+    def _parse(path, stat):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        entry = {
+            'name': os.path.basename(path),
+            'size': stat.st_size,
+            'mtime': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            'hash': hashlib.sha256(raw).hexdigest(),
+            'plays': [],
+            'hosts': [],
+            'roles': [],
+            'error': None
+        }
+        try:
+            data = yaml.load(raw, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            entry['error'] = str(e)
+            return entry
+        if not isinstance(data, list):
+            entry['error'] = "Un playbook doit être une liste de plays"
+            return entry
+
+        roles = set()
+        for play in data:
+            if not isinstance(play, dict):
+                continue
+            hosts = play.get('hosts')
+            if isinstance(hosts, list):
+                hosts = ','.join(str(pattern) for pattern in hosts)
+            entry['plays'].append({'name': play.get('name'), 'hosts': hosts})
+            if hosts is not None and str(hosts) not in entry['hosts']:
+                entry['hosts'].append(str(hosts))
+        RevisionService.references(data, roles, set())
+        entry['roles'] = sorted(roles)
+        return entry
+
+    @staticmethod
+    def refresh():
+        """Rescan the directory, return True when the catalog changed"""
+        keys, changed = {}, {}
+        try:
+            scanned = list(os.scandir(Config.PLAYBOOKS_DIR))
+        except FileNotFoundError:
+            scanned = []
+        for item in scanned:
+            # Hidden files are saves being checked, not playbooks yet
+            if item.name.startswith('.') or not item.name.endswith(('.yml', '.yaml')) or not item.is_file():
+                continue
+            try:
+                stat = item.stat()
+                key = (stat.st_mtime_ns, stat.st_size)
+                keys[item.name] = key
+                if PlaybookCatalog._keys.get(item.name) != key:
+                    changed[item.name] = PlaybookCatalog._parse(item.path, stat)
+            except OSError:
+                # Removed between the scan and the read
+                keys.pop(item.name, None)
+
+        with PlaybookCatalog._lock:
+            if not changed and keys.keys() == PlaybookCatalog._keys.keys():
+                return False
+            entries = {name: PlaybookCatalog._entries[name] for name in keys if name not in changed}
+            entries.update(changed)
+            PlaybookCatalog._entries = entries
+            PlaybookCatalog._keys = keys
+        return True
+
+    @staticmethod
+    def entries():
+        if PlaybookCatalog._watcher is None and not PlaybookCatalog._keys:
+            # No watcher, e.g. CLI commands: read the directory on demand
+            PlaybookCatalog.refresh()
+        with PlaybookCatalog._lock:
+            return [PlaybookCatalog._entries[name] for name in sorted(PlaybookCatalog._entries)]
+
+    @staticmethod
+    def start_watcher(app):
+        """Poll the playbooks directory in a background thread (no inotify dependency)"""
+        if PlaybookCatalog._watcher is not None:
+            return
+        PlaybookCatalog.refresh()
+
+        def run():
+            changed = True
+            while True:
+                if changed:
+                    # Check playbooks edited outside the application before anyone deploys them
+                    try:
+                        with app.app_context():
+                            if os.path.exists(Config.get_database_path()):
+                                PlaybookService.check_catalog()
+                    except Exception as e:
+                        logger.error(f"Erreur lors de la vérification des playbooks: {str(e)}")
+                time.sleep(Config.PLAYBOOK_CATALOG_POLL_INTERVAL)
+                try:
+                    changed = PlaybookCatalog.refresh()
+                    if changed:
+                        # Edits made outside the application invalidate cached responses too
+                        with app.app_context():
+                            DataVersion.bump('playbooks')
+                except Exception as e:
+                    changed = False
+                    logger.error(f"Erreur lors de l'analyse des playbooks: {str(e)}")
+
+        thread = threading.Thread(target=run, name='playbook-catalog', daemon=True)
+        PlaybookCatalog._watcher = thread
+        thread.start()
+
 
 class PlaybookService:
     @staticmethod
     def list_playbooks():
-        os.makedirs(Config.PLAYBOOKS_DIR, exist_ok=True)
-        return [
-            f for f in os.listdir(Config.PLAYBOOKS_DIR)
-            if f.endswith('.yml') or f.endswith('.yaml')
-        ]
+        return [entry['name'] for entry in PlaybookCatalog.entries()]
+
+    @staticmethod
+    def get_catalog():
+        return PlaybookCatalog.entries()
+
+    @staticmethod
+    def _syntax_check(path):
+        """Run ansible-playbook --syntax-check, return (error, checked)"""
+        try:
+            result = subprocess.run(
+                ['ansible-playbook', '--syntax-check', '-i', 'localhost,', path],
+                cwd=Config.ANSIBLE_DIR,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                timeout=Config.PLAYBOOK_SYNTAX_CHECK_TIMEOUT
+            )
+        except FileNotFoundError:
+            return None, False
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Vérification syntaxique trop longue: {os.path.basename(path)}")
+            return None, False
+        if result.returncode != 0:
+            output = result.stdout.strip().replace(path, os.path.basename(path))
+            return f"Erreur de syntaxe Ansible: {output[-2000:]}", True
+        return None, True
+
+    @staticmethod
+    def _check(path, syntax=True):
+        """Validate a playbook file, results are cached by content hash
+
+        Without syntax, ansible-playbook --syntax-check is left for a later
+        check and only the YAML and the structure are validated.
+        """
+        with open(path, 'rb') as f:
+            raw = f.read()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        cached = DatabaseManager.get_playbook_check(content_hash)
+        # Checks made without the syntax check are completed later
+        if cached and (cached['syntax_checked'] or not cached['ok'] or not syntax or not Config.PLAYBOOK_SYNTAX_CHECK):
+            return cached['error']
+
+        error = ValidationService.validate_playbook_content(raw)
+        syntax_checked = False
+        if error is None and syntax and Config.PLAYBOOK_SYNTAX_CHECK:
+            # Do not hold a pooled connection during the subprocess
+            release_db()
+            error, syntax_checked = PlaybookService._syntax_check(path)
+        DatabaseManager.save_playbook_check(content_hash, error, syntax_checked)
+        return error
+
+    @staticmethod
+    def check_playbook(filename, syntax=True):
+        """Error message of an existing playbook, None if it is valid"""
+        return PlaybookService._check(Config.get_playbook_path(filename), syntax)
+
+    @staticmethod
+    def check_catalog():
+        """Check the playbooks not checked yet, cached ones cost a hash and a lookup"""
+        for entry in PlaybookCatalog.entries():
+            try:
+                PlaybookService.check_playbook(entry['name'])
+            except FileNotFoundError:
+                # Removed since the last scan
+                pass
+
+    @staticmethod
+    def _save(filepath, content):
+        """Check the content in a hidden file next to the target, then move it in place"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix='.check-', suffix='.yml')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            error = PlaybookService._check(tmp_path)
+            if error:
+                raise ValueError(error)
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     @staticmethod
     def create_playbook(filename, content):
@@ -18,8 +231,9 @@ class PlaybookService:
         filepath = Config.get_playbook_path(filename)
         if os.path.exists(filepath):
             raise ValueError("Le playbook existe déjà")
-        with open(filepath, 'w') as f:
-            f.write(content)
+        PlaybookService._save(filepath, content)
+        PlaybookCatalog.refresh()
+        DataVersion.bump('playbooks')
 
     @staticmethod
     def update_playbook(filename, content):
@@ -28,8 +242,9 @@ class PlaybookService:
         filepath = Config.get_playbook_path(filename)
         if not os.path.exists(filepath):
             raise ValueError("Playbook non trouvé")
-        with open(filepath, 'w') as f:
-            f.write(content)
+        PlaybookService._save(filepath, content)
+        PlaybookCatalog.refresh()
+        DataVersion.bump('playbooks')
 
     @staticmethod
     def delete_playbook(filename):
@@ -39,3 +254,5 @@ class PlaybookService:
         if not os.path.exists(filepath):
             raise ValueError("Playbook non trouvé")
         os.remove(filepath)
+        PlaybookCatalog.refresh()
+        DataVersion.bump('playbooks')
@@ -0,0 +1,181 @@
+import io
+import os
+import re
+import hmac
+import json
+import time
+import pstats
+import random
+import logging
+import cProfile
+import tempfile
+from flask import g, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingService:
+    """Opt-in request profiling and a bounded on-disk store of slow requests
+
+    A request is profiled with cProfile, and the SQL it issues is traced on
+    its pooled connection, when it carries the X-Linsec-Profile header set
+    to the configured token, or when it falls in the sampled percentage.
+    Token requests are always stored, others only when slower than the
+    threshold; the oldest records are dropped beyond the store size.
+    """
+    HEADER = 'X-Linsec-Profile'
+    RECORD_ID = re.compile(r'^\d+-\d+$')
+    # Streams, metrics and the store itself are never profiled
+    EXCLUDED_PREFIXES = ('/static/', '/debug/', '/metrics', '/events')
+
+    @staticmethod
+    def authorized():
+        token = Config.PROFILING_TOKEN
+        return bool(token) and hmac.compare_digest(request.headers.get(ProfilingService.HEADER, ''), token)
+
+    @staticmethod
+    def _mode():
+        if ProfilingService.authorized():
+            return 'token'
+        if Config.PROFILING_SAMPLE_RATE > 0 and random.random() * 100 < Config.PROFILING_SAMPLE_RATE:
+            return 'sample'
+        return None
+
+    @staticmethod
+    def init_app(app):
+        @app.before_request
+        def start_profiling():
+            if request.path.startswith(ProfilingService.EXCLUDED_PREFIXES):
+                return
+            g.profile_started = time.perf_counter()
+            mode = ProfilingService._mode()
+            if mode is None:
+                return
+
+            statements = []
+            started = g.profile_started
+
+            def trace(sql):
+                if len(statements) < Config.PROFILING_MAX_STATEMENTS:
+                    statements.append([round(time.perf_counter() - started, 6), sql])
+
+            g.profile_mode = mode
+            g.sql_trace = trace
+            g.sql_statements = statements
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                # Another profiler is active in this process, keep the SQL trace only
+                pass
+
+        @app.after_request
+        def finish_profiling(response):
+            started = g.pop('profile_started', None)
+            if started is None:
+                return response
+            duration = time.perf_counter() - started
+            profiler = g.pop('profiler', None)
+            if profiler is not None:
+                profiler.disable()
+
+            mode = g.get('profile_mode')
+            if mode == 'token' or duration >= Config.SLOW_REQUEST_THRESHOLD:
+                try:
+                    record_id = ProfilingService.save({
+                        'method': request.method,
+                        'path': request.full_path.rstrip('?'),
+                        'route': request.url_rule.rule if request.url_rule else None,
+                        'status': response.status_code,
+                        'duration': round(duration, 6),
+                        'profiled': mode,
+                        'sql': g.get('sql_statements'),
+                    }, profiler)
+                    if mode == 'token':
+                        response.headers['X-Linsec-Profile-Id'] = record_id
+                except Exception as e:
+                    logger.error(f"Erreur lors de l'enregistrement de la requête lente: {str(e)}")
+            return response
+
+    @staticmethod
+    def _profile_text(profiler):
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(Config.PROFILING_TOP_FUNCTIONS)
+        return stream.getvalue()
+
+    @staticmethod
+    def save(record, profiler=None):
+        """Store a request record and its profile, return its id"""
+        directory = Config.get_slow_requests_path()
+        os.makedirs(directory, exist_ok=True)
+        # Ids sort by time, the pid keeps workers apart
+        record_id = f"{time.time_ns()}-{os.getpid()}"
+        record = dict(
+            record, id=record_id,
+            timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
+            profile=ProfilingService._profile_text(profiler) if profiler is not None else None
+        )
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(directory, f"{record_id}.prof"))
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.record.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, os.path.join(directory, f"{record_id}.json"))
+        ProfilingService._prune(directory)
+        return record_id
+
+    @staticmethod
+    def _record_ids(directory):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        ids = [name[:-len('.json')] for name in names
+               if name.endswith('.json') and ProfilingService.RECORD_ID.match(name[:-len('.json')])]
+        return sorted(ids, key=lambda record_id: [int(part) for part in record_id.split('-')])
+
+    @staticmethod
+    def _prune(directory):
+        ids = ProfilingService._record_ids(directory)
+        for record_id in ids[:max(0, len(ids) - Config.SLOW_REQUEST_STORE_SIZE)]:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(directory, record_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def get_record(record_id):
+        if not ProfilingService.RECORD_ID.match(record_id):
+            return None
+        try:
+            with open(os.path.join(Config.get_slow_requests_path(), f"{record_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def get_profile_path(record_id):
+        """Raw cProfile stats of a record, for pstats or snakeviz"""
+        if not ProfilingService.RECORD_ID.match(record_id):
+            return None
+        path = os.path.join(Config.get_slow_requests_path(), f"{record_id}.prof")
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def list_records():
+        """Stored requests from the most recent, without their profile and SQL"""
+        records = []
+        for record_id in reversed(ProfilingService._record_ids(Config.get_slow_requests_path())):
+            record = ProfilingService.get_record(record_id)
+            if record is None:
+                continue
+            sql = record.pop('sql', None)
+            record['sql_count'] = len(sql) if sql is not None else None
+            record['has_profile'] = record.pop('profile', None) is not None
+            records.append(record)
+        return records
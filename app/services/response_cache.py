@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+from config import Config
+from services.data_version import DataVersion
+
+
+class ResponseCache:
+    """Per-process cache of GET responses keyed by URL and data versions"""
+
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(key, versions):
+        with ResponseCache._lock:
+            entry = ResponseCache._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != versions:
+                del ResponseCache._entries[key]
+                return None
+            ResponseCache._entries.move_to_end(key)
+            return entry[1]
+
+    @staticmethod
+    def put(key, versions, response):
+        with ResponseCache._lock:
+            ResponseCache._entries[key] = (versions, response)
+            ResponseCache._entries.move_to_end(key)
+            while len(ResponseCache._entries) > Config.RESPONSE_CACHE_SIZE:
+                ResponseCache._entries.popitem(last=False)
+
+
+def cached_response(*namespaces):
+    """Serve a GET view with a strong ETag derived from the data versions it depends on
+
+    Matching If-None-Match requests get a 304 and unchanged bodies are served
+    from memory, neither touches SQLite nor the filesystem.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = tuple(DataVersion.get(namespace) for namespace in namespaces)
+            key = request.full_path
+            digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+            etag = '-'.join(
+                [f"{DataVersion.get('generation'):x}"]
+                + [f'{n[0]}{v}' for n, v in zip(namespaces, versions)]
+                + [digest]
+            )
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                cached = ResponseCache.get(key, versions)
+                if cached is not None:
+                    body, status, headers = cached
+                    response = make_response(body, status, headers)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    ResponseCache.put(key, versions, (
+                        response.get_data(), response.status_code, dict(response.headers)
+                    ))
+
+            response.set_etag(etag)
+            # Browsers revalidate every time and get a 304 while nothing changed
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
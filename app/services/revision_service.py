@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import threading
+import yaml
+from config import Config
+from services.yaml_loader import YamlLoader
+
+ROLE_INCLUDE_KEYS = (
+    'include_role', 'import_role', 'ansible.builtin.include_role', 'ansible.builtin.import_role'
+)
+PLAYBOOK_IMPORT_KEYS = ('import_playbook', 'ansible.builtin.import_playbook')
+
+
+class RevisionService:
+    """Content hashes telling whether a host already got the current playbook
+
+    The revision of a playbook covers its file, the playbooks it imports and
+    every file of the roles it uses, directly or through includes and role
+    dependencies. File digests are cached by mtime and size.
+    """
+    _digests = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _file_digest(path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with RevisionService._lock:
+            cached = RevisionService._digests.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with RevisionService._lock:
+            RevisionService._digests[path] = (key, digest)
+        return digest
+
+    @staticmethod
+    def _load_yaml(path):
+        try:
+            with open(path, 'rb') as f:
+                return yaml.load(f, Loader=YamlLoader)
+        except (OSError, yaml.YAMLError):
+            return None
+
+    @staticmethod
+    def references(data, roles, playbooks):
+        """Collect role names and imported playbooks referenced anywhere in a YAML document"""
+        if isinstance(data, list):
+            for item in data:
+                RevisionService.references(item, roles, playbooks)
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                if key in ('roles', 'dependencies') and isinstance(value, list):
+                    for role in value:
+                        name = role if isinstance(role, str) else (role or {}).get('role') or (role or {}).get('name')
+                        if isinstance(name, str):
+                            roles.add(name)
+                elif key in ROLE_INCLUDE_KEYS and isinstance(value, dict) and isinstance(value.get('name'), str):
+                    roles.add(value['name'])
+                elif key in PLAYBOOK_IMPORT_KEYS and isinstance(value, str):
+                    playbooks.add(value)
+                RevisionService.references(value, roles, playbooks)
+
+    @staticmethod
+    def _role_path(name):
+        if '{{' in name:
+            return None
+        for root in (os.path.join(Config.PLAYBOOKS_DIR, 'roles'), os.path.join(Config.ANSIBLE_DIR, 'roles')):
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                return path
+        return None
+
+    @staticmethod
+    def playbook_revision(playbook):
+        """Hash of a playbook and of everything it pulls in"""
+        digest = hashlib.sha256()
+        pending = [Config.get_playbook_path(playbook)]
+        seen_files, seen_roles = set(), set()
+
+        while pending:
+            path = pending.pop()
+            if path in seen_files or not os.path.isfile(path):
+                continue
+            seen_files.add(path)
+            digest.update(f"playbook:{os.path.relpath(path, Config.ANSIBLE_DIR)}:{RevisionService._file_digest(path)}\n".encode())
+
+            roles, playbooks = set(), set()
+            RevisionService.references(RevisionService._load_yaml(path), roles, playbooks)
+            pending += [os.path.join(os.path.dirname(path), p) for p in sorted(playbooks) if '{{' not in p]
+
+            roles_pending = sorted(roles)
+            while roles_pending:
+                role_path = RevisionService._role_path(roles_pending.pop())
+                if role_path is None or role_path in seen_roles:
+                    continue
+                seen_roles.add(role_path)
+                for root, dirs, files in os.walk(role_path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        file_path = os.path.join(root, name)
+                        digest.update(
+                            f"role:{os.path.relpath(file_path, Config.ANSIBLE_DIR)}:"
+                            f"{RevisionService._file_digest(file_path)}\n".encode()
+                        )
+                        if name.endswith(('.yml', '.yaml')) and os.path.basename(root) in ('tasks', 'meta', 'handlers'):
+                            nested = set()
+                            RevisionService.references(RevisionService._load_yaml(file_path), nested, set())
+                            roles_pending += sorted(nested)
+        return digest.hexdigest()
+
+    @staticmethod
+    def vars_digest(inventory):
+        """Hash of the inventory vars a host is deployed with"""
+        return hashlib.sha256(json.dumps(inventory, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,186 @@
+import os
+import time
+import socket
+import logging
+import threading
+import uuid
+import click
+from flask.helpers import get_debug_flag
+from werkzeug.serving import is_running_from_reloader
+from config import Config
+from database import DatabaseManager
+from services.metrics_service import DEPLOYMENT_DURATION, DEPLOYMENTS, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class DeploymentScheduler:
+    """Persistent deployment queue served by a fixed pool of worker threads
+
+    Jobs live in the deployments table, so every process shares the same
+    queue and the same global and per-environment concurrency caps. Running
+    jobs carry a heartbeat; jobs whose process died are requeued or failed.
+    """
+    _condition = threading.Condition()
+    _workers = []
+    _runner = None
+    # (pid, id) of this process, a fork gets its own
+    _worker_id = (None, None)
+
+    @staticmethod
+    def init_app(app, runner):
+        """Register the job runner and start the workers in processes that serve requests"""
+        DeploymentScheduler._runner = runner
+
+        # Jobs and hosts left behind by a previous run of the application
+        with app.app_context():
+            if os.path.exists(Config.get_database_path()):
+                DeploymentScheduler.recover()
+
+        MetricsRegistry.register_collector('linsec_deployment_jobs', DeploymentScheduler.queue_metrics)
+
+        # Queued and requeued jobs must not wait for a first request
+        if DeploymentScheduler.serves_requests(app):
+            DeploymentScheduler.start(app)
+
+        @app.before_request
+        def start_deployment_workers():
+            # Fallback for servers started in a way serves_requests cannot tell
+            if not DeploymentScheduler._workers and not app.testing:
+                DeploymentScheduler.start(app)
+
+    @staticmethod
+    def serves_requests(app):
+        """False in tests, in flask CLI commands other than run and in the reloader's watcher process"""
+        if app.testing:
+            return False
+        if click.get_current_context(silent=True) is not None and os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+            return False
+        # With the reloader, requests are served by a child process started with WERKZEUG_RUN_MAIN
+        if get_debug_flag() and not is_running_from_reloader():
+            return False
+        return True
+
+    @staticmethod
+    def worker_id():
+        """Id of this process in the queue, never reused even when a restarted container reuses pids"""
+        pid, worker_id = DeploymentScheduler._worker_id
+        if pid != os.getpid():
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+            DeploymentScheduler._worker_id = (os.getpid(), worker_id)
+        return worker_id
+
+    @staticmethod
+    def start(app):
+        with DeploymentScheduler._condition:
+            if DeploymentScheduler._workers:
+                return
+            for i in range(Config.DEPLOYMENT_WORKERS):
+                worker = threading.Thread(
+                    target=DeploymentScheduler._work, args=(app,),
+                    name=f'deployment-worker-{i}', daemon=True
+                )
+                DeploymentScheduler._workers.append(worker)
+                worker.start()
+            threading.Thread(
+                target=DeploymentScheduler._heartbeat, args=(app,),
+                name='deployment-heartbeat', daemon=True
+            ).start()
+
+    @staticmethod
+    def queue_metrics():
+        """Jobs waiting and running in the shared queue, read at scrape time"""
+        return 'linsec_deployment_jobs', 'gauge', 'Deployment jobs queued or running in every process', [
+            ({'status': status}, DatabaseManager.count_deployments({'status': status}))
+            for status in ('queued', 'running')
+        ]
+
+    @staticmethod
+    def wake():
+        with DeploymentScheduler._condition:
+            DeploymentScheduler._condition.notify_all()
+
+    @staticmethod
+    def enqueue(environment, playbook, hosts, priority=0, revision=None, vars_hashes=None):
+        queued = DatabaseManager.enqueue_deployment(
+            environment, playbook, hosts, priority, Config.DEPLOYMENT_QUEUE_MAX, revision, vars_hashes
+        )
+        if queued is None:
+            raise ValueError("La file d'attente des déploiements est pleine")
+        DeploymentScheduler.wake()
+        return queued
+
+    @staticmethod
+    def recover():
+        """Requeue or fail orphaned running jobs and reset the hosts they left deploying"""
+        try:
+            requeued, failed = DatabaseManager.recover_deployments(
+                Config.DEPLOYMENT_STALE_AFTER, Config.DEPLOYMENT_MAX_ATTEMPTS
+            )
+            if requeued:
+                DatabaseManager.update_hosts_status(requeued, 'pending')
+                DeploymentScheduler.wake()
+            if failed:
+                DatabaseManager.update_hosts_status(failed, 'error')
+            if requeued or failed:
+                DatabaseManager.update_stats()
+                logger.warning(
+                    f"Déploiements orphelins récupérés: {len(requeued)} hôte(s) remis en file, "
+                    f"{len(failed)} hôte(s) en erreur"
+                )
+        except Exception as e:
+            logger.error(f"Erreur de récupération des déploiements: {str(e)}")
+
+    @staticmethod
+    def _heartbeat(app):
+        while True:
+            time.sleep(Config.DEPLOYMENT_HEARTBEAT_INTERVAL)
+            with app.app_context():
+                try:
+                    DatabaseManager.heartbeat_deployments(DeploymentScheduler.worker_id())
+                except Exception as e:
+                    logger.error(f"Erreur de la file de déploiement: {str(e)}")
+                # Pick up jobs of processes that died since startup
+                DeploymentScheduler.recover()
+
+    @staticmethod
+    def _claim(app):
+        with app.app_context():
+            try:
+                return DatabaseManager.claim_deployment(
+                    DeploymentScheduler.worker_id(),
+                    Config.DEPLOYMENT_MAX_CONCURRENT,
+                    Config.DEPLOYMENT_MAX_PER_ENVIRONMENT
+                )
+            except Exception as e:
+                logger.error(f"Erreur de la file de déploiement: {str(e)}")
+                return None
+
+    @staticmethod
+    def _work(app):
+        while True:
+            job = DeploymentScheduler._claim(app)
+            if job is None:
+                # Other processes enqueue and finish jobs too, poll as a fallback
+                with DeploymentScheduler._condition:
+                    DeploymentScheduler._condition.wait(Config.DEPLOYMENT_POLL_INTERVAL)
+                continue
+
+            with app.app_context():
+                exit_code = None
+                started = time.perf_counter()
+                try:
+                    exit_code = DeploymentScheduler._runner(job)
+                except Exception as e:
+                    logger.error(f"Erreur de déploiement: {str(e)}")
+                finally:
+                    status = 'succeeded' if exit_code == 0 else 'failed'
+                    DatabaseManager.finish_deployment(
+                        job['id'], status, exit_code, 'ok' if exit_code == 0 else 'failed'
+                    )
+                    DEPLOYMENTS.inc(job['environment'], job['playbook'], status)
+                    DEPLOYMENT_DURATION.observe(
+                        time.perf_counter() - started, job['environment'], job['playbook'], status
+                    )
+            # A slot is free again
+            DeploymentScheduler.wake()
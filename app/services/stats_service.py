@@ -0,0 +1,149 @@
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from config import Config
+from database import DatabaseManager, STATS_METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class StatsService:
+    """Stats time series: compaction into minute/hour/day buckets and range queries"""
+
+    _compaction_thread = None
+
+    @staticmethod
+    def resolutions():
+        return [
+            ('minute', 60, Config.STATS_MINUTE_RETENTION),
+            ('hour', 3600, Config.STATS_HOUR_RETENTION),
+            ('day', 86400, Config.STATS_DAY_RETENTION)
+        ]
+
+    @staticmethod
+    def check_retentions():
+        """Reject a raw retention shorter than the coarsest bucket
+
+        Queries complete the rolled-up buckets with the raw samples after their
+        watermark, which can be one full bucket behind: shorter raw retentions
+        would leave holes in the history.
+        """
+        minimum = max(step for _, step, _ in StatsService.resolutions())
+        if Config.STATS_RAW_RETENTION < minimum:
+            raise ValueError(
+                f"LINSEC_STATS_RAW_RETENTION doit être d'au moins {minimum} secondes "
+                f"({Config.STATS_RAW_RETENTION} configurées)"
+            )
+
+    @staticmethod
+    def compact(now=None):
+        now = int(now if now is not None else time.time())
+        DatabaseManager.compact_stats(Config.STATS_RAW_RETENTION, StatsService.resolutions(), now)
+
+    @staticmethod
+    def start_compaction(app):
+        """Run compaction periodically in a background thread"""
+        StatsService.check_retentions()
+        if StatsService._compaction_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(Config.STATS_COMPACTION_INTERVAL)
+                try:
+                    with app.app_context():
+                        StatsService.compact()
+                except Exception as e:
+                    logger.error(f"Erreur lors de la compaction des statistiques: {str(e)}")
+
+        thread = threading.Thread(target=run, name='stats-compaction', daemon=True)
+        StatsService._compaction_thread = thread
+        thread.start()
+
+    @staticmethod
+    def parse_time(value, default):
+        """Parse an epoch or an ISO 8601 date (UTC when naive)"""
+        if value in (None, ''):
+            return default
+        if re.match(r'^\d+(\.\d+)?$', value):
+            return int(float(value))
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"Date invalide: {value}")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp())
+
+    @staticmethod
+    def parse_step(value):
+        """Parse a step in seconds, optionally suffixed with s, m, h or d"""
+        if value in (None, ''):
+            return None
+        match = re.match(r'^(\d+)([smhd]?)$', value)
+        if not match or int(match.group(1)) == 0:
+            raise ValueError(f"Pas invalide: {value}")
+        return int(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+    @staticmethod
+    def choose_resolution(start, end, step, now):
+        """Pick the coarsest resolution not coarser than step that still covers start"""
+        if step is None:
+            step = max(1, -(-(end - start) // Config.STATS_HISTORY_MAX_POINTS))
+
+        candidates = [(None, 1, Config.STATS_RAW_RETENTION)] + StatsService.resolutions()
+        chosen = None
+        for candidate in candidates:
+            name, res_step, retention = candidate
+            if start >= now - retention and (chosen is None or res_step <= step):
+                chosen = candidate
+        if chosen is None:
+            chosen = candidates[-1]
+
+        resolution, res_step, _ = chosen
+        return resolution, -(-step // res_step) * res_step
+
+    @staticmethod
+    def get_history(start, end, step=None, now=None):
+        now = int(now if now is not None else time.time())
+        if end <= start:
+            raise ValueError("La date de fin doit être postérieure à la date de début")
+
+        resolution, step = StatsService.choose_resolution(start, end, step, now)
+        if resolution is None:
+            rows = DatabaseManager.get_stats_samples(start, end, step)
+        else:
+            # Rolled-up buckets, completed with raw samples not yet compacted
+            watermark = DatabaseManager.get_stats_watermark(resolution)
+            rows = list(DatabaseManager.get_stats_rollups(resolution, start, min(end, watermark), step))
+            if end > watermark:
+                rows += DatabaseManager.get_stats_samples(max(start, watermark), end, step)
+
+        buckets = {}
+        for row in rows:
+            point = buckets.get(row['bucket'])
+            if point is None:
+                buckets[row['bucket']] = dict(row)
+                continue
+            point['samples'] += row['samples']
+            for metric in STATS_METRICS:
+                point[f'{metric}_sum'] += row[f'{metric}_sum']
+                point[f'{metric}_min'] = min(point[f'{metric}_min'], row[f'{metric}_min'])
+                point[f'{metric}_max'] = max(point[f'{metric}_max'], row[f'{metric}_max'])
+
+        points = []
+        for bucket in sorted(buckets):
+            row = buckets[bucket]
+            point = {
+                'timestamp': datetime.fromtimestamp(bucket, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                'samples': row['samples']
+            }
+            for metric in STATS_METRICS:
+                point[metric] = round(row[f'{metric}_sum'] / row['samples'], 2)
+                point[f'{metric}_min'] = row[f'{metric}_min']
+                point[f'{metric}_max'] = row[f'{metric}_max']
+            points.append(point)
+
+        return {'resolution': resolution or 'raw', 'step': step, 'points': points}
@@ -1,6 +1,16 @@
+import re
+import yaml
+from services.yaml_loader import YamlLoader
+
+
 class ValidationService:
     """Service pour valider les données"""
 
+    SECURITY_LEVELS = ('low', 'medium', 'high', 'critical')
+    NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+    PLAY_IMPORT_KEYS = ('import_playbook', 'ansible.builtin.import_playbook')
+    PLAY_TASK_KEYS = ('pre_tasks', 'tasks', 'post_tasks', 'handlers')
+
     @staticmethod
     def validate_ip(ip):
         parts = ip.split('.')
@@ -17,3 +27,56 @@ class ValidationService:
     @staticmethod
     def validate_playbook_name(filename):
         return filename and (filename.endswith('.yml') or filename.endswith('.yaml'))
+
+    @staticmethod
+    def validate_playbook_content(content):
+        """Return an error message for a playbook that is not valid YAML or not shaped like plays"""
+        try:
+            data = yaml.load(content, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            return f"YAML invalide: {str(e)}"
+        if not isinstance(data, list) or not data:
+            return "Un playbook doit être une liste non vide de plays"
+
+        for index, play in enumerate(data, 1):
+            if not isinstance(play, dict):
+                return f"Play {index}: un play doit être un dictionnaire"
+            if any(key in play for key in ValidationService.PLAY_IMPORT_KEYS):
+                continue
+            if 'hosts' not in play:
+                return f"Play {index}: champ manquant: hosts"
+            for key in ValidationService.PLAY_TASK_KEYS:
+                tasks = play.get(key)
+                if tasks is None:
+                    continue
+                if not isinstance(tasks, list):
+                    return f"Play {index}: {key} doit être une liste"
+                if not all(isinstance(task, dict) for task in tasks):
+                    return f"Play {index}: chaque élément de {key} doit être un dictionnaire"
+            roles = play.get('roles')
+            if roles is not None:
+                if not isinstance(roles, list):
+                    return f"Play {index}: roles doit être une liste"
+                for role in roles:
+                    if not isinstance(role, (str, dict)) or (isinstance(role, dict) and not (role.get('role') or role.get('name'))):
+                        return f"Play {index}: rôle invalide: {role}"
+        return None
+
+    @staticmethod
+    def validate_host(host_data):
+        """Return an error message for invalid host data, None if valid"""
+        for field in ('name', 'ip', 'environment', 'security_level'):
+            if not host_data.get(field):
+                return f"Champ manquant: {field}"
+        if not ValidationService.NAME_PATTERN.match(host_data['name']):
+            return f"Nom d'hôte invalide: {host_data['name']}"
+        if not ValidationService.validate_ip(host_data['ip']):
+            return f"Adresse IP invalide: {host_data['ip']}"
+        if not ValidationService.NAME_PATTERN.match(host_data['environment']):
+            return f"Environnement invalide: {host_data['environment']}"
+        if host_data['security_level'] not in ValidationService.SECURITY_LEVELS:
+            return f"Niveau de sécurité invalide: {host_data['security_level']}"
+        for group in host_data['groups'].split(',') if host_data.get('groups') else []:
+            if not ValidationService.NAME_PATTERN.match(group):
+                return f"Groupe invalide: {group}"
+        return None
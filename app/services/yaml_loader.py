@@ -0,0 +1,4 @@
+import yaml
+
+# libyaml bindings are an order of magnitude faster on large documents
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
@@ -236,8 +236,8 @@ function setupServerSentEvents() {
             updateStatsDisplay();
         }
         
-        if (data.type === 'hosts') {
-            hosts = data.data;
+        if (data.type === 'hosts' || data.type === 'hosts_delta') {
+            hosts = data.type === 'hosts' ? data.data : applyHostsDelta(hosts, data.data);
             renderHostsTable();
             // Mettre à jour la sélection d'hôtes si visible
             if (hostSelectionContainer.style.display === 'block') {
@@ -252,8 +252,10 @@ function setupServerSentEvents() {
     
     eventSource.onerror = (error) => {
         console.error('Erreur SSE:', error);
-        // Tentative de reconnexion après un délai
-        setTimeout(setupServerSentEvents, 5000);
+        // Le navigateur se reconnecte seul avec Last-Event-ID, sauf si le flux est fermé
+        if (eventSource.readyState === EventSource.CLOSED) {
+            setTimeout(setupServerSentEvents, 5000);
+        }
     };
 }
 
@@ -725,11 +727,24 @@ function setupServerSentEvents() {
     
     eventSource.onerror = (error) => {
         console.error('Erreur SSE:', error);
-        // Tentative de reconnexion après un délai
-        setTimeout(setupServerSentEvents, 5000);
+        // Le navigateur se reconnecte seul avec Last-Event-ID, sauf si le flux est fermé
+        if (eventSource.readyState === EventSource.CLOSED) {
+            setTimeout(setupServerSentEvents, 5000);
+        }
     };
 }
 
+// Appliquer un delta d'hôtes (ajoutés/modifiés et supprimés)
+function applyHostsDelta(currentHosts, delta) {
+    const byId = new Map(currentHosts.map(host => [host.id, host]));
+    (delta.deleted || []).forEach(id => byId.delete(id));
+    (delta.hosts || []).forEach(host => byId.set(host.id, host));
+    // Même ordre que l'instantané complet : les plus récents en premier
+    return [...byId.values()].sort((a, b) =>
+        (b.added_date || '').localeCompare(a.added_date || '') || b.id - a.id
+    );
+}
+
 // Traiter les données SSE
 function handleSSEData(data) {
     if (data.type === 'stats') {
@@ -737,8 +752,8 @@ function handleSSEData(data) {
         updateStatsDisplay();
     }
     
-    if (data.type === 'hosts') {
-        hosts = data.data || [];
+    if (data.type === 'hosts' || data.type === 'hosts_delta') {
+        hosts = data.type === 'hosts' ? (data.data || []) : applyHostsDelta(hosts, data.data || {});
         renderHostsTable();
         
         // Mettre à jour la sélection d'hôtes si visible
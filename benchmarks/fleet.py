@@ -0,0 +1,29 @@
+"""Synthetic fleets for the benchmarks
+
+Hosts are spread across environments and groups the way a real Linsec
+installation is, and generated from a seed so every run measures the
+same data.
+"""
+import random
+
+ENVIRONMENTS = ('production', 'staging', 'development')
+GROUPS = ('web', 'db', 'app', 'cache', 'lb', 'monitoring')
+SECURITY_LEVELS = ('low', 'medium', 'high', 'critical')
+
+
+def host(index, rng, prefix='bench'):
+    groups = rng.sample(GROUPS, rng.choice((0, 1, 1, 2, 3)))
+    return {
+        'name': f"{prefix}-{index:06d}",
+        'ip': f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}",
+        'environment': ENVIRONMENTS[index % len(ENVIRONMENTS)],
+        'security_level': rng.choice(SECURITY_LEVELS),
+        'groups': ','.join(groups),
+        'status': 'secured' if rng.random() < 0.6 else 'pending'
+    }
+
+
+def generate_fleet(size, seed=0, prefix='bench', start=0):
+    """Host dicts ready for DatabaseManager.add_hosts"""
+    rng = random.Random(f"{seed}-{prefix}-{start}")
+    return [host(index, rng, prefix) for index in range(start, start + size)]
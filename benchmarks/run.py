@@ -0,0 +1,390 @@
+"""Benchmarks of the Linsec control plane on synthetic fleets
+
+Each fleet size runs in its own process against a throwaway instance
+directory, with benchmarks/stub/ansible-playbook first on PATH. Results
+are written as JSON and compared with benchmarks/baseline.json: metrics
+ending in _per_s are better when higher, every other one when lower.
+
+    python benchmarks/run.py                          # 1k and 10k hosts
+    python benchmarks/run.py --sizes 1000,10000,100000 --output results.json
+    python benchmarks/run.py --update-baseline        # after an intended change
+
+The exit status is 1 when a metric regressed beyond the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_DIR = os.path.join(REPO_DIR, 'app')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+ROUNDS = 20
+ADD_HOST_REQUESTS = 100
+SSE_SUBSCRIBERS = 50
+DEPLOYMENTS = 20
+DEPLOYMENT_HOSTS = 10
+DEPLOYMENT_TIMEOUT = 300
+
+
+def p50(samples):
+    return round(statistics.median(samples), 3)
+
+
+def best(samples):
+    return round(min(samples), 3)
+
+
+def p95(samples):
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+
+
+def timed(fn, rounds=ROUNDS, before=None):
+    """Wall time of each call in milliseconds"""
+    samples = []
+    for _ in range(rounds):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def setup(root):
+    """Application pointed at a fresh instance under root"""
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    os.chdir(APP_DIR)
+
+    from config import Config
+    Config.INVENTORY_DIR = os.path.join(root, 'inventories')
+    Config.ANSIBLE_DIR = os.path.join(root, 'taskengine')
+    Config.PLAYBOOKS_DIR = os.path.join(root, 'taskengine', 'playbooks')
+    Config.LOG_DIR = os.path.join(root, 'logs')
+    Config.FACT_CACHE_DIR = os.path.join(root, 'fact_cache')
+    Config.INVENTORY_CACHE_DIR = os.path.join(root, 'inventory_cache')
+    Config.INVENTORY_SCRIPT = os.path.join(REPO_DIR, 'taskengine', 'linsec_inventory.py')
+    Config.CALLBACK_PLUGINS_DIR = os.path.join(REPO_DIR, 'taskengine', 'callback_plugins')
+    # Fixed so results do not depend on the core count of the machine
+    Config.DEPLOYMENT_WORKERS = 2
+    Config.DEPLOYMENT_MAX_CONCURRENT = 2
+    Config.DEPLOYMENT_MAX_PER_ENVIRONMENT = 2
+    Config.DEPLOYMENT_MAX_SHARDS = 1
+    # Deployment workers must not start before the instance folder is swapped,
+    # they start with the first request instead
+    Config.TESTING = True
+
+    import app as app_module
+    from database import init_db_app
+    app = app_module.create_app()
+    app.testing = False
+    app.instance_path = os.path.join(root, 'instance')
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(APP_DIR, 'instance', 'schema.sql')) as f:
+        schema = f.read()
+    import sqlite3
+    db = sqlite3.connect(os.path.join(app.instance_path, 'linsec.db'))
+    db.executescript(schema)
+    db.close()
+    init_db_app(app)
+    return app
+
+
+def bench_seed(fleet):
+    from database import DatabaseManager, release_db
+    start = time.perf_counter()
+    DatabaseManager.add_hosts(fleet)
+    DatabaseManager.update_stats()
+    elapsed = time.perf_counter() - start
+    release_db()
+    return {'seed_hosts_per_s': round(len(fleet) / elapsed, 1)}
+
+
+def bench_add_host(client, size):
+    from fleet import generate_fleet
+    extra = iter(generate_fleet(ADD_HOST_REQUESTS, prefix='extra', start=size))
+
+    def add():
+        host = next(extra)
+        response = client.post('/add-host', data={
+            'hostname': host['name'], 'ip': host['ip'], 'environment': host['environment'],
+            'groups': host['groups'], 'security-level': host['security_level']
+        })
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    samples = timed(add, ADD_HOST_REQUESTS)
+    return {
+        'add_host_ms_p50': p50(samples),
+        'add_host_ms_p95': p95(samples),
+        'add_host_per_s': round(1000 * len(samples) / sum(samples), 1)
+    }
+
+
+def bench_routes(app, client):
+    from services.data_version import DataVersion
+    results = {}
+
+    def get(url):
+        def call():
+            response = client.get(url)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        return call
+
+    def bump(namespace):
+        def call():
+            with app.app_context():
+                DataVersion.bump(namespace)
+        return call
+
+    routes = (
+        ('hosts_page', '/hosts?limit=500', 'hosts'),
+        ('hosts_environment', '/hosts?environment=production&limit=500', 'hosts'),
+        ('hosts_group', '/hosts?group=db&status=pending&limit=500', 'hosts'),
+        ('stats', '/stats', 'stats'),
+    )
+    for name, url, namespace in routes:
+        # Cold: data changed since the last request, warm: served from the response cache
+        cold = timed(get(url), before=bump(namespace))
+        warm = timed(get(url))
+        results[f'{name}_cold_ms_p50'] = p50(cold)
+        results[f'{name}_cold_ms_p95'] = p95(cold)
+        results[f'{name}_warm_ms_p50'] = p50(warm)
+    results['hosts_page_bytes'] = len(client.get('/hosts?limit=500').get_data())
+    return results
+
+
+def bench_inventory(app, fleet):
+    """Dynamic inventory --list, what ansible-playbook pays at start"""
+    from config import Config
+    with app.app_context():
+        database = Config.get_database_path()
+    limit_file = os.path.join(Config.LOG_DIR, 'bench-limit')
+    with open(limit_file, 'w') as f:
+        f.write(''.join(f"{host['name']}\n" for host in fleet[:300:3]))
+
+    def run(ttl, limit=''):
+        env = dict(os.environ, LINSEC_DATABASE=database, LINSEC_INVENTORY_ENVIRONMENT='production',
+                   LINSEC_INVENTORY_LIMIT=limit, LINSEC_INVENTORY_CACHE_DIR=Config.INVENTORY_CACHE_DIR,
+                   LINSEC_INVENTORY_CACHE_TTL=str(ttl))
+
+        def call():
+            result = subprocess.run([sys.executable, Config.INVENTORY_SCRIPT, '--list'],
+                                    env=env, stdout=subprocess.PIPE, check=True)
+            return result.stdout
+        return call
+
+    # Interpreter start-up varies a lot between runs, keep the best one
+    rounds = 5
+    run(60)()
+    return {
+        'inventory_list_ms_min': best(timed(run(0), rounds)),
+        'inventory_list_cached_ms_min': best(timed(run(60), rounds)),
+        'inventory_limit_ms_min': best(timed(run(0, limit_file), rounds)),
+        'inventory_list_bytes': len(run(0)())
+    }
+
+
+def bench_sse(app, client):
+    """Payload sizes and CPU spent per subscriber on join and on a host change"""
+    from services.event_service import EventService
+
+    def frames_until(stream, marker):
+        frames = []
+        for frame in stream:
+            frames.append(frame)
+            # Only look at the head, snapshots are megabytes long
+            if marker in frame[:100]:
+                return frames
+
+    results = {}
+    with app.app_context():
+        streams = [EventService.get_event_stream() for _ in range(SSE_SUBSCRIBERS)]
+
+        # The first subscriber builds the snapshot, the others share it
+        start = time.perf_counter()
+        first = frames_until(streams[0], '"type": "hosts"')
+        results['sse_snapshot_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        results['sse_snapshot_bytes'] = sum(len(frame.encode()) for frame in first)
+
+        cpu = time.process_time()
+        for stream in streams[1:]:
+            frames_until(stream, '"type": "hosts"')
+        results['sse_join_cpu_ms_per_subscriber'] = round(
+            (time.process_time() - cpu) * 1000 / (SSE_SUBSCRIBERS - 1), 4
+        )
+
+    response = client.post('/add-host', data={
+        'hostname': 'sse-probe', 'ip': '10.255.255.254', 'environment': 'production',
+        'groups': 'web', 'security-level': 'low'
+    })
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    with app.app_context():
+        cpu = time.process_time()
+        delta = [frames_until(stream, '"type": "stats"') for stream in streams]
+        results['sse_delta_cpu_ms_per_subscriber'] = round(
+            (time.process_time() - cpu) * 1000 / SSE_SUBSCRIBERS, 4
+        )
+        results['sse_delta_bytes'] = sum(len(frame.encode()) for frame in delta[0])
+        for stream in streams:
+            stream.close()
+    return results
+
+
+def bench_deployments(app, client, fleet):
+    """Scheduling overhead: the stub playbook returns immediately"""
+    from config import Config
+    with open(os.path.join(Config.PLAYBOOKS_DIR, 'bench.yml'), 'w') as f:
+        f.write("- hosts: all\n  gather_facts: false\n  tasks:\n    - ping:\n")
+
+    production = [host['name'] for host in fleet if host['environment'] == 'production']
+    job_ids, samples = [], []
+    start = time.perf_counter()
+    for index in range(DEPLOYMENTS):
+        hosts = production[index * DEPLOYMENT_HOSTS:(index + 1) * DEPLOYMENT_HOSTS]
+        request_start = time.perf_counter()
+        response = client.post('/deploy', json={'environment': 'production', 'playbook': 'bench.yml', 'hosts': hosts})
+        samples.append((time.perf_counter() - request_start) * 1000)
+        assert response.status_code == 202, response.get_data(as_text=True)
+        job_ids.append(response.get_json()['job_id'])
+
+    pending = set(job_ids)
+    while pending:
+        if time.perf_counter() - start > DEPLOYMENT_TIMEOUT:
+            raise RuntimeError(f"Déploiements non terminés: {sorted(pending)}")
+        for job_id in list(pending):
+            job = client.get(f'/deployments/{job_id}').get_json()['deployment']
+            if job['status'] not in ('queued', 'running'):
+                assert job['status'] == 'succeeded', job
+                pending.discard(job_id)
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    return {
+        'deploy_request_ms_p50': p50(samples),
+        'deploy_request_ms_p95': p95(samples),
+        'deploy_overhead_ms_per_job': round(elapsed * 1000 / DEPLOYMENTS, 3)
+    }
+
+
+def run_size(size):
+    """Run every benchmark on one fleet size, in this process"""
+    root = tempfile.mkdtemp(prefix='linsec-bench-')
+    try:
+        app = setup(root)
+        from fleet import generate_fleet
+        fleet = generate_fleet(size)
+        results = {'hosts': size}
+        with app.app_context():
+            results.update(bench_seed(fleet))
+        client = app.test_client()
+        results.update(bench_add_host(client, size))
+        results.update(bench_routes(app, client))
+        results.update(bench_inventory(app, fleet))
+        results.update(bench_sse(app, client))
+        results.update(bench_deployments(app, client, fleet))
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run_sizes(sizes):
+    env = dict(os.environ, PATH=os.path.join(BENCH_DIR, 'stub') + os.pathsep + os.environ.get('PATH', ''))
+    results = {}
+    for size in sizes:
+        print(f"Benchmark sur {size} hôtes...", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', str(size)],
+            env=env, stdout=subprocess.PIPE, check=True, text=True
+        ).stdout
+        results[str(size)] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Lines describing every metric, and the regressions beyond tolerance
+
+    Timings that moved by less than min_delta_ms are never regressions,
+    a few milliseconds is scheduling noise on a shared machine; p95 values
+    of a few rounds are close to the maximum and only reported.
+    """
+    lines, regressions = [], []
+    for size, metrics in results.items():
+        reference = baseline.get('results', {}).get(size, {})
+        for name, value in metrics.items():
+            previous = reference.get(name)
+            if name == 'hosts' or not previous or not isinstance(value, (int, float)):
+                continue
+            ratio = value / previous
+            worse = ratio < 1 - tolerance if name.endswith('_per_s') else ratio > 1 + tolerance
+            if name.endswith('_p95') or ('_ms' in name and abs(value - previous) < min_delta_ms):
+                worse = False
+            line = f"{size:>7} {name:<40} {previous:>12} -> {value:<12} x{ratio:.2f}"
+            lines.append(line + ('  REGRESSION' if worse else ''))
+            if worse:
+                regressions.append(line)
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks du plan de contrôle Linsec')
+    parser.add_argument('--sizes', default='1000,10000', help='tailles de parc, séparées par des virgules')
+    parser.add_argument('--output', help='fichier JSON des résultats')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='écart relatif toléré avant de signaler une régression (0.5 = 50%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=5,
+                        help='écart absolu en dessous duquel une durée ne régresse pas')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker)))
+        return 0
+
+    report = {
+        'meta': {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': run_sizes([int(size) for size in args.sizes.split(',')])
+    }
+    data = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(data)
+        print(f"Référence mise à jour: {args.baseline}", file=sys.stderr)
+        return 0
+    if not args.output:
+        print(data)
+
+    if not os.path.exists(args.baseline):
+        print("Aucune référence, relancer avec --update-baseline", file=sys.stderr)
+        return 0
+    with open(args.baseline) as f:
+        lines, regressions = compare(report['results'], json.load(f), args.tolerance, args.min_delta_ms)
+    print('\n'.join(lines), file=sys.stderr)
+    if regressions:
+        print(f"\n{len(regressions)} régression(s) au-delà de {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# Linsec per-host results callback
+#
+# Writes one JSON line per host to the file named by LINSEC_RESULTS_FILE
+# when the playbook ends, so the web application can record the outcome
+# of every host instead of relying on the exit code alone.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: linsec_results
+    type: aggregate
+    short_description: Write per-host results as JSON lines for Linsec
+    description:
+      - Records the recap counts of each host and the message of its last failure.
+    requirements:
+      - enable in configuration
+    options:
+      results_file:
+        description: Path of the JSON lines file to append to
+        env:
+          - name: LINSEC_RESULTS_FILE
+'''
+
+import json
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'linsec_results'
+    CALLBACK_NEEDS_ENABLED = True
+
+    MAX_MESSAGE = 500
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self._messages = {}
+
+    def _failure(self, result):
+        res = result._result
+        message = res.get('msg') or res.get('stderr') or res.get('reason') or ''
+        self._messages[result._host.get_name()] = '%s: %s' % (
+            result._task.get_name(), str(message)[:self.MAX_MESSAGE]
+        )
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        if not ignore_errors:
+            self._failure(result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._failure(result)
+
+    def v2_playbook_on_stats(self, stats):
+        path = self.get_option('results_file')
+        if not path:
+            return
+        with open(path, 'a') as f:
+            for host in sorted(stats.processed):
+                summary = stats.summarize(host)
+                f.write(json.dumps({
+                    'host': host,
+                    'ok': summary['ok'],
+                    'changed': summary['changed'],
+                    'failures': summary['failures'],
+                    'unreachable': summary['unreachable'],
+                    'skipped': summary['skipped'],
+                    'message': self._messages.get(host),
+                }) + '\n')
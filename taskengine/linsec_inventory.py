@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Linsec dynamic inventory
+#
+# Builds the Ansible inventory straight from the hosts table of the Linsec
+# SQLite database, so the inventory and the database can never disagree.
+# group_vars/ and host_vars/ next to this script still apply.
+#
+# Environment:
+#   LINSEC_DATABASE                path of linsec.db
+#   LINSEC_INVENTORY_ENVIRONMENT   only list the hosts of this environment
+#   LINSEC_INVENTORY_LIMIT         file with one host name per line (or an
+#                                  ansible --limit @file), only list these
+#   LINSEC_INVENTORY_CACHE_DIR     where --list results are cached
+#   LINSEC_INVENTORY_CACHE_TTL     cache lifetime in seconds, 0 disables it
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+
+DATABASE = os.environ.get('LINSEC_DATABASE', '/opt/linsec/app/instance/linsec.db')
+CACHE_DIR = os.environ.get('LINSEC_INVENTORY_CACHE_DIR', '/opt/linsec/.ansible/inventory_cache')
+CACHE_TTL = float(os.environ.get('LINSEC_INVENTORY_CACHE_TTL', '5'))
+CHUNK_SIZE = 500
+
+
+# The application loads this module to hash what each host is deployed
+# with, keep these two free of anything but the row they get
+def host_vars(row):
+    return {'ansible_host': row['ip'], 'linsec_security_level': row['security_level']}
+
+
+def host_groups(row):
+    return sorted({group for group in (row['groups'] or '').split(',') if group})
+
+
+def read_limit(path):
+    if not path:
+        return None
+    with open(path) as f:
+        return sorted({line.strip() for line in f if line.strip()})
+
+
+def connect():
+    # Read-only: the inventory never takes a write lock the application could wait on
+    db = sqlite3.connect(f'file:{DATABASE}?mode=ro', uri=True, timeout=5)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA query_only = ON')
+    return db
+
+
+def fetch_hosts(db, environment, names):
+    query = 'SELECT name, ip, security_level, groups FROM hosts'
+    where, params = [], []
+    if environment:
+        where.append('environment = ?')
+        params.append(environment)
+    if names is None:
+        return db.execute(query + (' WHERE ' + ' AND '.join(where) if where else ''), params).fetchall()
+
+    rows = []
+    for i in range(0, len(names), CHUNK_SIZE):
+        chunk = names[i:i + CHUNK_SIZE]
+        clause = where + [f"name IN ({','.join('?' * len(chunk))})"]
+        rows += db.execute(query + ' WHERE ' + ' AND '.join(clause), params + chunk).fetchall()
+    return rows
+
+
+def build_inventory(rows):
+    inventory = {'_meta': {'hostvars': {}}, 'all': {'children': ['ungrouped']}, 'ungrouped': {'hosts': []}}
+    for row in sorted(rows, key=lambda r: r['name']):
+        inventory['_meta']['hostvars'][row['name']] = host_vars(row)
+        for group in host_groups(row) or ['ungrouped']:
+            if group not in inventory:
+                inventory[group] = {'hosts': []}
+                inventory['all']['children'].append(group)
+            inventory[group]['hosts'].append(row['name'])
+    return inventory
+
+
+def cache_key(environment, names):
+    # Every commit touches the WAL or the database file, their stamps version the data
+    stamps = []
+    for path in (DATABASE, DATABASE + '-wal'):
+        try:
+            stat = os.stat(path)
+            stamps.append([stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            stamps.append(None)
+    data = json.dumps([DATABASE, environment, names, stamps])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def read_cache(key):
+    path = os.path.join(CACHE_DIR, key + '.json')
+    try:
+        if time.time() - os.stat(path).st_mtime > CACHE_TTL:
+            return None
+        with open(path) as f:
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(key, data):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='.inventory.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, key + '.json'))
+        # Keys change with every database write, drop the entries nobody can hit anymore
+        now = time.time()
+        for item in os.scandir(CACHE_DIR):
+            if item.name.endswith('.json') and now - item.stat().st_mtime > CACHE_TTL:
+                os.remove(item.path)
+    except OSError:
+        # The cache is an optimisation only
+        pass
+
+
+def list_inventory(environment, names):
+    key = cache_key(environment, names) if CACHE_TTL > 0 else None
+    if key:
+        cached = read_cache(key)
+        if cached is not None:
+            return cached
+
+    db = connect()
+    try:
+        data = json.dumps(build_inventory(fetch_hosts(db, environment, names)))
+    finally:
+        db.close()
+    if key:
+        write_cache(key, data)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Linsec dynamic inventory')
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--host')
+    args = parser.parse_args()
+
+    environment = os.environ.get('LINSEC_INVENTORY_ENVIRONMENT') or None
+    limit = os.environ.get('LINSEC_INVENTORY_LIMIT', '')
+    names = read_limit(limit[1:] if limit.startswith('@') else limit)
+
+    if args.host:
+        # _meta is always returned, ansible only calls this for old-style lookups
+        db = connect()
+        try:
+            rows = fetch_hosts(db, environment, [args.host])
+        finally:
+            db.close()
+        sys.stdout.write(json.dumps(host_vars(rows[0]) if rows else {}))
+    else:
+        sys.stdout.write(list_inventory(environment, names))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+sys.path.insert(0, APP_DIR)
+
+from config import Config
+
+
+class DeploymentCoalescingTest(unittest.TestCase):
+    """Requests joining the queued or running jobs of the same playbook"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        root = cls.tmp.name
+        Config.LOG_DIR = os.path.join(root, 'logs')
+        Config.PLAYBOOKS_DIR = os.path.join(root, 'playbooks')
+        # No deployment workers
+        Config.TESTING = True
+
+        os.chdir(APP_DIR)
+        import app as app_module
+        from database import init_db_app
+        cls.app = app_module.create_app()
+        cls.app.instance_path = os.path.join(root, 'instance')
+        os.makedirs(cls.app.instance_path, exist_ok=True)
+        with open(os.path.join(APP_DIR, 'instance', 'schema.sql')) as f:
+            db = sqlite3.connect(os.path.join(cls.app.instance_path, 'linsec.db'))
+            db.executescript(f.read())
+            db.close()
+        init_db_app(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        from database import DatabaseManager, get_db, release_db
+        self.db = DatabaseManager
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        get_db().execute('DELETE FROM deployment_hosts')
+        get_db().execute('DELETE FROM deployments')
+        get_db().commit()
+        self.addCleanup(self.ctx.pop)
+        self.addCleanup(release_db)
+
+    def enqueue(self, hosts, revision='r1', vars_hashes=None):
+        if vars_hashes is None:
+            vars_hashes = {name: 'v1' for name in hosts}
+        return self.db.enqueue_deployment('production', 'site.yml', hosts, 0, 10, revision, vars_hashes)
+
+    def run_job(self, hosts, revision='r1'):
+        job_id, _, _, _ = self.enqueue(hosts, revision)
+        job = self.db.claim_deployment('test', 10, 10)
+        self.assertEqual(job['id'], job_id)
+        self.db.set_deployment_revision(job_id, revision, {name: 'v1' for name in hosts})
+        return job_id
+
+    def test_merges_into_queued_job(self):
+        queued_id, coalesced, added, covered = self.enqueue(['web-1', 'web-2'])
+        self.assertFalse(coalesced)
+        self.assertEqual((added, covered), (['web-1', 'web-2'], []))
+
+        job_id, coalesced, added, covered = self.enqueue(['web-2', 'web-3'])
+        self.assertEqual(job_id, queued_id)
+        self.assertTrue(coalesced)
+        self.assertEqual((added, covered), (['web-3'], ['web-2']))
+        self.assertEqual(
+            [row['host_name'] for row in self.db.get_deployment_hosts(queued_id)], ['web-1', 'web-2', 'web-3']
+        )
+
+    def test_covered_by_running_job(self):
+        running_id = self.run_job(['web-1', 'web-2'])
+
+        job_id, coalesced, added, covered = self.enqueue(['web-1', 'web-2'])
+        self.assertEqual(job_id, running_id)
+        self.assertTrue(coalesced)
+        self.assertEqual((added, covered), ([], ['web-1', 'web-2']))
+
+        # Hosts deployed with other vars are not covered
+        job_id, _, added, covered = self.enqueue(['web-1', 'web-2'], vars_hashes={'web-1': 'v1', 'web-2': 'v2'})
+        self.assertNotEqual(job_id, running_id)
+        self.assertEqual((added, covered), (['web-2'], ['web-1']))
+
+    def test_follows_running_job_of_older_revision(self):
+        running_id = self.run_job(['web-1', 'web-2'], revision='r1')
+
+        job_id, coalesced, added, covered = self.enqueue(['web-2', 'web-3'], revision='r2')
+        self.assertNotEqual(job_id, running_id)
+        self.assertFalse(coalesced)
+        self.assertEqual((added, covered), (['web-2', 'web-3'], []))
+        self.assertEqual(self.db.get_deployment(job_id)['follows'], running_id)
+        # Not claimable while the outdated run is on its hosts
+        self.assertIsNone(self.db.claim_deployment('test', 10, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+sys.path.insert(0, APP_DIR)
+
+from config import Config
+
+
+class HostListingTest(unittest.TestCase):
+    """GET /hosts for paging and non-paging clients"""
+
+    FLEET_SIZE = Config.HOSTS_PAGE_SIZE * 2 + 7
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        root = cls.tmp.name
+        Config.LOG_DIR = os.path.join(root, 'logs')
+        Config.PLAYBOOKS_DIR = os.path.join(root, 'playbooks')
+        # No deployment workers
+        Config.TESTING = True
+
+        os.chdir(APP_DIR)
+        import app as app_module
+        from database import DatabaseManager, init_db_app, release_db
+        cls.app = app_module.create_app()
+        cls.app.instance_path = os.path.join(root, 'instance')
+        os.makedirs(cls.app.instance_path, exist_ok=True)
+        with open(os.path.join(APP_DIR, 'instance', 'schema.sql')) as f:
+            db = sqlite3.connect(os.path.join(cls.app.instance_path, 'linsec.db'))
+            db.executescript(f.read())
+            db.close()
+        init_db_app(cls.app)
+
+        with cls.app.app_context():
+            DatabaseManager.add_hosts([{
+                'name': f'host-{i:05d}', 'ip': f'10.0.{i >> 8}.{i & 255}',
+                'environment': 'production' if i % 2 else 'staging',
+                'security_level': 'medium', 'groups': 'web', 'status': 'pending'
+            } for i in range(cls.FLEET_SIZE)])
+            release_db()
+        cls.client = cls.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_without_pagination_returns_every_host(self):
+        response = self.client.get('/hosts')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), self.FLEET_SIZE)
+        self.assertEqual(response.headers['X-Total-Count'], str(self.FLEET_SIZE))
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+    def test_filters_without_pagination_return_every_match(self):
+        hosts = self.client.get('/hosts?environment=production').get_json()
+        self.assertEqual(len(hosts), self.FLEET_SIZE // 2)
+
+    def test_cursor_pages_cover_every_host_once(self):
+        names = []
+        url = '/hosts?limit=100'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()
+            self.assertLessEqual(len(page), 100)
+            names += [host['name'] for host in page]
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/hosts?limit=100&cursor={cursor}' if cursor else None
+        self.assertEqual(len(names), self.FLEET_SIZE)
+        self.assertEqual(len(set(names)), self.FLEET_SIZE)
+
+    def test_cursor_without_limit_uses_default_page_size(self):
+        first = self.client.get('/hosts?limit=1')
+        response = self.client.get(f"/hosts?cursor={first.headers['X-Next-Cursor']}")
+        self.assertEqual(len(response.get_json()), Config.HOSTS_PAGE_SIZE)
+        self.assertIn('X-Next-Cursor', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()